@@ -1,4 +1,8 @@
+import hashlib
 import json
+import os
+import threading
+import time
 try:
     import cv2
 except ImportError as exc:
@@ -7,12 +11,585 @@ except ImportError as exc:
     ) from exc
 import numpy as np
 
+from tracing import tracer
+
+
+def to_bgr(image):
+    """Return ``image`` as a BGR ``ndarray`` without touching the disk.
+
+    ``image`` may be a file path, a NumPy array (BGR, BGRA or grayscale) or a
+    PIL image.  BGR arrays are returned unchanged so no copy is made.
+    """
+    if image is None:
+        return None
+    if isinstance(image, str):
+        return cv2.imread(image)
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        return image
+    # PIL image: np.asarray shares the pixel buffer, only the channel swap copies
+    mode = getattr(image, 'mode', None)
+    if mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGB')
+        mode = 'RGB'
+    arr = np.asarray(image)
+    if mode == 'L':
+        return cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
+    if mode == 'RGBA':
+        return cv2.cvtColor(arr, cv2.COLOR_RGBA2BGR)
+    return cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
+
+
+# colour modes understood by the template matcher; single letters select one BGR channel
+COLOR_MODES = ('bgr', 'gray', 'b', 'g', 'r')
+
+
+def color_variant(image, gray, mode, downsample=1):
+    """Return ``image`` in colour ``mode``, shrunk by the integer ``downsample`` factor."""
+    if mode == 'bgr':
+        out = image
+    elif mode == 'gray':
+        out = gray
+    elif mode in ('b', 'g', 'r'):
+        out = cv2.extractChannel(image, 'bgr'.index(mode))
+    else:
+        raise ValueError(f"Unknown colour mode {mode!r}, choose from {', '.join(COLOR_MODES)}")
+    if downsample > 1:
+        h, w = out.shape[:2]
+        out = cv2.resize(out, (max(1, w // downsample), max(1, h // downsample)), interpolation=cv2.INTER_AREA)
+    return out
+
+
+# ORB detector profiles: feature budget, ORB pyramid levels, FAST threshold
+# and the (rows, cols) grid keypoints are spread over.  'default' matches
+# cv2.ORB_create().  A lower FAST threshold finds corners on flat icons, the
+# grid keeps busy text areas from taking the whole budget.
+ORB_PROFILES = {
+    'default': {'nfeatures': 500, 'nlevels': 8, 'fast_threshold': 20, 'grid': (1, 1)},
+    'fast': {'nfeatures': 500, 'nlevels': 4, 'fast_threshold': 25, 'grid': (1, 1)},
+    'balanced': {'nfeatures': 2000, 'nlevels': 8, 'fast_threshold': 12, 'grid': (4, 4)},
+    'accurate': {'nfeatures': 6000, 'nlevels': 8, 'fast_threshold': 7, 'grid': (8, 8)},
+}
+ORB_PROFILE = 'default'
+# candidates detected per kept keypoint when bucketing, so sparse cells can be filled
+ORB_GRID_OVERSAMPLE = 3
+
+
+def _bucket_keypoints(keypoints, shape, grid, budget):
+    """Keep up to ``budget`` keypoints, the strongest of every grid cell first."""
+    rows, cols = grid
+    if len(keypoints) <= budget:
+        return keypoints
+    pts = np.array([kp.pt for kp in keypoints], np.float32)
+    response = np.array([kp.response for kp in keypoints], np.float32)
+    h, w = shape[:2]
+    cell = (np.minimum(pts[:, 1] * rows // h, rows - 1) * cols
+            + np.minimum(pts[:, 0] * cols // w, cols - 1)).astype(np.int32)
+    order = np.lexsort((-response, cell))
+    sorted_cells = cell[order]
+    starts = np.searchsorted(sorted_cells, sorted_cells, side='left')
+    rank = np.empty(len(order), np.int64)
+    rank[order] = np.arange(len(order)) - starts
+    # round-robin over the cells: every cell's best, then every cell's second best...
+    keep = np.lexsort((-response, rank))[:budget]
+    return [keypoints[i] for i in keep]
+
+
+def _keypoint_array(keypoints):
+    if not keypoints:
+        return np.empty((0, 2), np.float32)
+    return cv2.KeyPoint_convert(keypoints).reshape(-1, 2)
+
+
+def detect_features(gray, profile=None):
+    """Return ORB ``(keypoints, descriptors)`` of ``gray`` using a profile from ``ORB_PROFILES``."""
+    params = ORB_PROFILES[profile or ORB_PROFILE]
+    budget = params['nfeatures']
+    grid = params['grid']
+    bucketed = grid[0] * grid[1] > 1
+    orb = cv2.ORB_create(nfeatures=budget * ORB_GRID_OVERSAMPLE if bucketed else budget,
+                         nlevels=params['nlevels'], fastThreshold=params['fast_threshold'])
+    if not bucketed:
+        return orb.detectAndCompute(gray, None)
+    keypoints = _bucket_keypoints(orb.detect(gray, None), gray.shape, grid, budget)
+    return orb.compute(gray, keypoints)
+
+
+def template_digest(template):
+    """Return the registry key of an in-memory template.
+
+    That is the SHA-1 of encoded image bytes, or of the BGR pixels plus
+    their size for arrays and PIL images.
+    """
+    if isinstance(template, (bytes, bytearray, memoryview)):
+        return hashlib.sha1(template).hexdigest()
+    image = to_bgr(template)
+    return hashlib.sha1(np.ascontiguousarray(image).data).hexdigest() + '%dx%d' % image.shape[:2]
+
+
+class TemplateEntry:
+    """A decoded template together with the data the matchers need."""
+
+    def __init__(self, image, digest=None, features=True):
+        self.digest = digest
+        self.image = image
+        self.gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # registry entries are shared by matcher threads; the lazy caches below are filled under it
+        self._lock = threading.RLock()
+        self._features = {}
+        self._points = {}
+        self.keypoints, self.descriptors = self.features() if features else (None, None)
+        # images handed to cv2.matchTemplate, keyed by (colour mode, downsample)
+        self.variants = {('bgr', 1): self.image, ('gray', 1): self.gray}
+        self._pyramid = [self.gray]
+        self._scaled = {1.0: self}
+
+    def scaled(self, scale):
+        """Return this template resized by ``scale`` (cached, without ORB features)."""
+        scale = round(float(scale), 3)
+        entry = self._scaled.get(scale)
+        if entry is None:
+            with self._lock:
+                entry = self._scaled.get(scale)
+                if entry is None:
+                    h, w = self.image.shape[:2]
+                    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+                    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+                    entry = TemplateEntry(cv2.resize(self.image, size, interpolation=interpolation),
+                                          features=False)
+                    self._scaled[scale] = entry
+        return entry
+
+    def features(self, profile=None):
+        """ORB ``(keypoints, descriptors)`` of the template for a detector profile (cached).
+
+        Templates are small, so the profile's grid is not applied.
+        """
+        profile = profile or ORB_PROFILE
+        features = self._features.get(profile)
+        if features is None:
+            with self._lock:
+                features = self._features.get(profile)
+                if features is None:
+                    params = ORB_PROFILES[profile]
+                    orb = cv2.ORB_create(nfeatures=params['nfeatures'], nlevels=params['nlevels'],
+                                         fastThreshold=params['fast_threshold'])
+                    features = self._features[profile] = orb.detectAndCompute(self.gray, None)
+        return features
+
+    def points(self, profile=None):
+        """``(N, 2)`` float32 coordinates of :meth:`features` keypoints (cached)."""
+        profile = profile or ORB_PROFILE
+        points = self._points.get(profile)
+        if points is None:
+            with self._lock:
+                points = self._points.get(profile)
+                if points is None:
+                    points = self._points[profile] = _keypoint_array(self.features(profile)[0])
+        return points
+
+    def variant(self, mode, downsample=1):
+        """Return the template as handed to ``cv2.matchTemplate`` (see :func:`color_variant`)."""
+        key = (mode, downsample)
+        image = self.variants.get(key)
+        if image is None:
+            with self._lock:
+                image = self.variants.get(key)
+                if image is None:
+                    image = self.variants[key] = color_variant(self.image, self.gray, mode, downsample)
+        return image
+
+    def prepare(self, scales=None, levels=None, color_mode=None, downsample=None):
+        """Precompute the scaled copies, their gray pyramids and match variants.
+
+        Defaults to ``TEMPLATE_SCALES``, ``TEMPLATE_PYRAMID_LEVELS``,
+        ``TEMPLATE_COLOR_MODE`` and ``TEMPLATE_DOWNSAMPLE``.
+        """
+        scales = TEMPLATE_SCALES if scales is None else scales
+        levels = TEMPLATE_PYRAMID_LEVELS if levels is None else levels
+        color_mode = color_mode or TEMPLATE_COLOR_MODE
+        downsample = downsample or TEMPLATE_DOWNSAMPLE
+        for scale in scales:
+            entry = self.scaled(scale)
+            entry.pyramid(levels)
+            entry.variant(color_mode, downsample)
+
+    def pyramid(self, level):
+        """Return the gray template downscaled ``level`` times by ``cv2.pyrDown``."""
+        if len(self._pyramid) <= level:
+            with self._lock:
+                while len(self._pyramid) <= level:
+                    self._pyramid.append(cv2.pyrDown(self._pyramid[-1]))
+        return self._pyramid[level]
+
+
+class TemplateRegistry:
+    """Load every template once and reuse its grayscale image and ORB features.
+
+    Entries are keyed by the SHA-1 of the file content, so identical templates
+    stored under different paths share one entry.  A path is re-hashed only
+    when its modification time or size changes.  In-memory templates are
+    kept only between :meth:`acquire` and :meth:`release`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}  # path -> ((mtime_ns, size), digest)
+        self._entries = {}  # digest -> TemplateEntry
+        self._refs = {}  # digest -> number of acquire() holders
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, template):
+        """Return the :class:`TemplateEntry` for a template, or ``None``.
+
+        ``template`` is a path, an encoded image buffer (``bytes`` or a
+        ``memoryview``, e.g. PNG data) or a BGR array.  An in-memory template
+        that is not held through :meth:`acquire` gets a fresh, uncached entry.
+        """
+        if template is None or isinstance(template, TemplateEntry):
+            return template
+        if isinstance(template, str):
+            return self._get_path(template)
+        return self._get_memory(template)
+
+    def acquire(self, template):
+        """Return the cached entry for an in-memory template and keep it until :meth:`release`."""
+        if template is None or isinstance(template, (str, TemplateEntry)):
+            return self.get(template)
+        return self._get_memory(template, acquire=True)
+
+    def release(self, entry):
+        """Drop one :meth:`acquire` reference to ``entry``, evicting it when unused."""
+        with self._lock:
+            count = self._refs.pop(entry.digest, 0) - 1
+            if count > 0:
+                self._refs[entry.digest] = count
+            elif self._unused(entry.digest):
+                self._entries.pop(entry.digest, None)
+
+    def _get_path(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            return None
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._paths.get(path)
+            if cached is not None and cached[0] == signature and cached[1] in self._entries:
+                return self._entries[cached[1]]
+        with open(path, 'rb') as f:
+            data = f.read()
+        entry = self._get_memory(data)
+        if entry is None:
+            return None
+        with self._lock:
+            self._release(path)
+            # releasing the old mapping may have dropped this very entry
+            entry = self._entries.setdefault(entry.digest, entry)
+            self._paths[path] = (signature, entry.digest)
+        return entry
+
+    def _get_memory(self, template, acquire=False):
+        image = None if isinstance(template, (bytes, bytearray, memoryview)) else to_bgr(template)
+        digest = template_digest(template if image is None else image)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                if acquire:
+                    self._refs[digest] = self._refs.get(digest, 0) + 1
+                return entry
+        if image is None:
+            with tracer.span('template.load'):
+                image = cv2.imdecode(np.frombuffer(template, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                return None
+        if acquire and image.base is not None:
+            # a cached entry must not pin the caller's buffer, e.g. a pack's mmap
+            image = image.copy()
+        entry = TemplateEntry(image, digest)
+        if acquire:
+            with self._lock:
+                entry = self._entries.setdefault(digest, entry)
+                self._refs[digest] = self._refs.get(digest, 0) + 1
+        return entry
+
+    def _unused(self, digest):
+        return digest not in self._refs and all(d != digest for _, d in self._paths.values())
+
+    def _release(self, path):
+        cached = self._paths.pop(path, None)
+        if cached is not None and self._unused(cached[1]):
+            self._entries.pop(cached[1], None)
+
+    def invalidate(self, path=None):
+        """Forget ``path`` (or every entry when ``path`` is ``None``)."""
+        with self._lock:
+            if path is None:
+                self._paths.clear()
+                self._entries.clear()
+                self._refs.clear()
+            else:
+                self._release(path)
+
+
+template_registry = TemplateRegistry()
+
+# Growth of the search window around the last hit, in multiples of the hit's
+# larger side.  The full frame is searched after the last window misses.
+ROI_PADDING = (0.5, 2.0, 8.0)
+
+# Coarse-to-fine template matching: number of pyrDown levels for the coarse
+# pass, how many coarse candidates are refined at full resolution, and the
+# smallest template side still usable at the coarse level.
+TEMPLATE_PYRAMID_LEVELS = 2
+TEMPLATE_TOP_K = 5
+TEMPLATE_MIN_SIDE = 12
+
+# Template sizes tried by the template matcher, relative to the captured
+# template.  Besides these, the caller's hint (the scale of the last hit or
+# the DPI ratio since capture) is tried first.  Every extra scale costs one
+# more full search per miss, so sweeping the common display scalings
+# (DPI_SCALES: 100%/125%/150%/200% and back) is opt-in.
+DPI_SCALES = (1.0, 1.25, 1.5, 2.0, 0.8, 0.667, 0.5)
+TEMPLATE_SCALES = (1.0,)
+# a hint within this relative distance of a configured scale adds no search
+SCALE_HINT_TOLERANCE = 0.02
+
+# Default colour mode (one of COLOR_MODES) and integer downsample factor for
+# template matching.  Gray halves the work of BGR by three, a downsample of 2
+# by four; items can override both.
+TEMPLATE_COLOR_MODE = 'bgr'
+TEMPLATE_DOWNSAMPLE = 1
+
+# Descriptor matcher used by feature matching.  'bf' compares every template
+# descriptor with every frame descriptor; 'flann' builds an LSH index over the
+# frame's descriptors once and queries it for every template; 'auto' picks
+# 'flann' for frames with at least FLANN_MIN_DESCRIPTORS descriptors, roughly
+# where a single template query breaks even (``bench_finder.py --crossover``).
+FEATURE_MATCHERS = ('auto', 'bf', 'flann')
+FEATURE_MATCHER = 'auto'
+FLANN_MIN_DESCRIPTORS = 5000
+FLANN_INDEX_PARAMS = {'algorithm': 6, 'table_number': 6, 'key_size': 12, 'multi_probe_level': 1}  # LSH
+FLANN_SEARCH_PARAMS = {'checks': 50}
+# Lowe's ratio test: keep a match when its distance is below this fraction of the runner-up's
+RATIO_TEST = 0.75
+
+# locate_all: result cap, IoU above which overlapping hits are merged, and how
+# far below the threshold a coarse pyramid peak may score and still be refined.
+# Identical instances defeat the ratio test, so feature correspondences are the
+# LOCATE_ALL_KNN nearest descriptors within FEATURE_MAX_DISTANCE bits, split
+# into instances by sequential RANSAC.  An instance needs FEATURE_MIN_INLIERS
+# inliers covering at least FEATURE_MIN_SCORE of the template's keypoints.
+LOCATE_ALL_MAX = 50
+LOCATE_ALL_IOU = 0.3
+TEMPLATE_COARSE_MARGIN = 0.2
+LOCATE_ALL_KNN = 8
+FEATURE_MAX_DISTANCE = 64
+FEATURE_MIN_INLIERS = 8
+FEATURE_MIN_SCORE = 0.05
+
+
+def non_max_suppression(hits, iou=LOCATE_ALL_IOU):
+    """Keep the best of every group of ``(score, match)`` hits overlapping by more than ``iou``."""
+    kept = []
+    for score, match in sorted(hits, key=lambda hit: -hit[0]):
+        (x1, y1), (x2, y2) = match[0], match[1]
+        area = max(0, x2 - x1) * max(0, y2 - y1)
+        for _, other in kept:
+            (ox1, oy1), (ox2, oy2) = other[0], other[1]
+            inter = max(0, min(x2, ox2) - max(x1, ox1)) * max(0, min(y2, oy2) - max(y1, oy1))
+            union = area + max(0, ox2 - ox1) * max(0, oy2 - oy1) - inter
+            if union > 0 and inter / union > iou:
+                break
+        else:
+            kept.append((score, match))
+    return kept
+
+
+def _pad_knn(distances, indices, k):
+    if indices.shape[1] < k:
+        pad = k - indices.shape[1]
+        distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.iinfo(np.int32).max)
+        indices = np.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+    return distances, indices
+
+
+def knn_bruteforce(query, train, k=2):
+    """Brute-force Hamming k-NN of ``query`` rows in ``train``.
+
+    Returns ``(distances, indices)`` arrays of shape ``(len(query), k)``;
+    missing neighbours have index -1.  Unlike ``BFMatcher.knnMatch`` no
+    ``DMatch`` objects are created.
+    """
+    distances, indices = cv2.batchDistance(query, train, cv2.CV_32S, normType=cv2.NORM_HAMMING, K=k,
+                                           update=0, crosscheck=False)
+    return _pad_knn(distances, indices, k)
+
+
+def build_lsh_index(train):
+    """Build a FLANN LSH index over binary descriptors ``train``."""
+    return cv2.flann_Index(train, FLANN_INDEX_PARAMS)
+
+
+def knn_lsh(index, query, k=2):
+    """Query an index from :func:`build_lsh_index`; same result layout as :func:`knn_bruteforce`."""
+    indices, distances = index.knnSearch(query, k, params=FLANN_SEARCH_PARAMS)
+    return distances, indices
+
+
+class FrameIndex:
+    """Per-frame data shared by every template matched against one screenshot.
+
+    The grayscale image, the ORB features and the gray pyramid are computed
+    lazily on first use and then reused for the lifetime of the frame.
+    """
+
+    def __init__(self, image, origin=(0, 0)):
+        self.image = to_bgr(image)
+        # position of this image's top-left pixel in screen coordinates
+        self.origin = origin
+        self._gray = None
+        self._features = {}
+        self._points = {}
+        self._pyramid = []
+        self._variants = {}
+        self._matchers = {}
+        # frames are shared by matcher threads; the lazy caches are filled under it
+        self._lock = threading.RLock()
+
+    @property
+    def gray(self):
+        if self._gray is None and self.image is not None:
+            with self._lock:
+                if self._gray is None:
+                    with tracer.span('frame.gray'):
+                        self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def features(self):
+        """``(keypoints, descriptors)`` of the whole frame for the default ORB profile."""
+        return self.detect()
+
+    def detect(self, profile=None):
+        """``(keypoints, descriptors)`` of the whole frame for an ORB profile (cached)."""
+        profile = profile or ORB_PROFILE
+        features = self._features.get(profile)
+        if features is None:
+            with self._lock:
+                features = self._features.get(profile)
+                if features is None:
+                    gray = self.gray
+                    with tracer.span('orb.detect', profile=profile):
+                        features = self._features[profile] = detect_features(gray, profile)
+        return features
+
+    def points(self, profile=None):
+        """``(N, 2)`` float32 coordinates of the :meth:`detect` keypoints (cached)."""
+        profile = profile or ORB_PROFILE
+        points = self._points.get(profile)
+        if points is None:
+            with self._lock:
+                points = self._points.get(profile)
+                if points is None:
+                    points = self._points[profile] = _keypoint_array(self.detect(profile)[0])
+        return points
+
+    def knn_match(self, descriptors, matcher='bf', k=2, profile=None):
+        """Return the ``k`` nearest frame descriptors for every row of ``descriptors``.
+
+        The result is a ``(distances, indices)`` pair of ``(len(descriptors), k)``
+        arrays as described in :func:`knn_bruteforce`.  With
+        ``matcher='flann'`` the LSH index over the frame's descriptors (of ORB
+        ``profile``) is built on first use and shared by every later query on
+        this frame.
+        """
+        profile = profile or ORB_PROFILE
+        frame_descriptors = self.detect(profile)[1]
+        if matcher == 'auto':
+            matcher = 'flann' if len(frame_descriptors) >= FLANN_MIN_DESCRIPTORS else 'bf'
+        if matcher not in FEATURE_MATCHERS:
+            raise ValueError(f"Unknown matcher {matcher!r}, choose from {', '.join(FEATURE_MATCHERS)}")
+        if matcher == 'bf' or len(frame_descriptors) < k:
+            return knn_bruteforce(descriptors, frame_descriptors, k)
+        with self._lock:
+            index = self._matchers.get(profile)
+            if index is None:
+                with tracer.span('flann.index'):
+                    index = self._matchers[profile] = build_lsh_index(frame_descriptors)
+        return knn_lsh(index, descriptors, k)
+
+    def pyramid(self, level):
+        """Return the gray frame downscaled ``level`` times by ``cv2.pyrDown``."""
+        if len(self._pyramid) <= level:
+            with self._lock:
+                if not self._pyramid:
+                    self._pyramid.append(self.gray)
+                while len(self._pyramid) <= level:
+                    with tracer.span('frame.pyramid'):
+                        self._pyramid.append(cv2.pyrDown(self._pyramid[-1]))
+        return self._pyramid[level]
+
+    def variant(self, mode, downsample=1):
+        """Return the frame in colour ``mode`` shrunk by ``downsample`` (cached)."""
+        key = (mode, downsample)
+        image = self._variants.get(key)
+        if image is None:
+            if key == ('bgr', 1):
+                return self.image
+            with self._lock:
+                image = self._variants.get(key)
+                if image is None:
+                    image = self._variants[key] = color_variant(self.image, self.gray, mode, downsample)
+        return image
+
+    def crop(self, x1, y1, x2, y2):
+        """Return a :class:`FrameIndex` viewing the given window of this frame."""
+        h, w = self.image.shape[:2]
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(w, int(x2)), min(h, int(y2))
+        sub = FrameIndex(self.image[y1:y2, x1:x2], (self.origin[0] + x1, self.origin[1] + y1))
+        if self._gray is not None:
+            sub._gray = self._gray[y1:y2, x1:x2]
+        return sub
+
 
 class KeyleFinderModule:
     """Locate a sub-image within a big image using ORB feature matching."""
 
-    def __init__(self, big_image_path: str):
-        self.big_image = cv2.imread(big_image_path)
+    def __init__(self, big_image, registry=None, pyramid_levels=None, scales=None, color_mode=None,
+                 downsample=None, matcher=None, orb_profile=None):
+        """``big_image`` is a path, a BGR ``ndarray``, a PIL screenshot or a :class:`FrameIndex`.
+
+        ``color_mode`` and ``downsample`` select how templates are matched
+        when feature matching fails, ``matcher`` is the descriptor matcher
+        (one of ``FEATURE_MATCHERS``) and ``orb_profile`` a key of
+        ``ORB_PROFILES``; ``None`` uses the module defaults.
+        """
+        self.frame = big_image if isinstance(big_image, FrameIndex) else FrameIndex(big_image)
+        self.big_image = self.frame.image
+        self.registry = template_registry if registry is None else registry
+        self.pyramid_levels = TEMPLATE_PYRAMID_LEVELS if pyramid_levels is None else pyramid_levels
+        self.scales = TEMPLATE_SCALES if scales is None else tuple(scales)
+        self.color_mode = color_mode or TEMPLATE_COLOR_MODE
+        self.downsample = int(downsample or TEMPLATE_DOWNSAMPLE)
+        if self.color_mode not in COLOR_MODES:
+            raise ValueError(f"Unknown colour mode {self.color_mode!r}, choose from {', '.join(COLOR_MODES)}")
+        if self.downsample < 1:
+            raise ValueError(f'downsample must be at least 1, got {self.downsample}')
+        self.matcher = matcher or FEATURE_MATCHER
+        if self.matcher not in FEATURE_MATCHERS:
+            raise ValueError(f"Unknown matcher {self.matcher!r}, choose from {', '.join(FEATURE_MATCHERS)}")
+        self.orb_profile = orb_profile or ORB_PROFILE
+        if self.orb_profile not in ORB_PROFILES:
+            raise ValueError(f"Unknown ORB profile {self.orb_profile!r}, choose from {', '.join(ORB_PROFILES)}")
 
     @staticmethod
     def _draw_multiline_text(img, text, org, font, scale, color, thickness=1, line_type=cv2.LINE_AA):
@@ -79,31 +656,37 @@ class KeyleFinderModule:
         cv2.waitKey(0)
         cv2.destroyAllWindows()
 
-    def _match_feature(self, single_image_path):
-        single_image = cv2.imread(single_image_path)
-        if single_image is None or self.big_image is None:
+    def _match_feature(self, template, frame=None, info=None):
+        """Match ORB features; ``info``, when given, receives the RANSAC inlier statistics."""
+        frame = self.frame if frame is None else frame
+        entry = self.registry.get(template)
+        if entry is None or frame.image is None:
             return None
-        single_gray = cv2.cvtColor(single_image, cv2.COLOR_BGR2GRAY)
-        big_gray = cv2.cvtColor(self.big_image, cv2.COLOR_BGR2GRAY)
-        orb = cv2.ORB_create()
-        kp1, des1 = orb.detectAndCompute(single_gray, None)
-        kp2, des2 = orb.detectAndCompute(big_gray, None)
+        des1 = entry.features(self.orb_profile)[1]
+        des2 = frame.detect(self.orb_profile)[1]
         if des1 is None or des2 is None:
             return None
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
-        matches = bf.knnMatch(des1, des2, k=2)
-        good = []
-        for m, n in matches:
-            if m.distance < 0.75 * n.distance:
-                good.append(m)
-        if len(good) < 4:
+        with tracer.span('orb.knn_match'):
+            distances, indices = frame.knn_match(des1, self.matcher, profile=self.orb_profile)
+            good = (indices[:, 0] >= 0) & (indices[:, 1] >= 0) & (distances[:, 0] < RATIO_TEST * distances[:, 1])
+        if np.count_nonzero(good) < 4:
             return None
-        src_pts = np.float32([kp1[m.queryIdx].pt for m in good])
-        dst_pts = np.float32([kp2[m.trainIdx].pt for m in good])
-        M, _ = cv2.estimateAffinePartial2D(src_pts, dst_pts, method=cv2.RANSAC)
+        src_pts = entry.points(self.orb_profile)[good]
+        dst_pts = frame.points(self.orb_profile)[indices[good, 0]]
+        with tracer.span('orb.ransac'):
+            M, inliers = cv2.estimateAffinePartial2D(src_pts, dst_pts, method=cv2.RANSAC)
         if M is None:
             return None
-        h, w = single_gray.shape
+        if info is not None:
+            count = int(np.count_nonzero(inliers))
+            info['inliers'] = count
+            info['inlier_ratio'] = count / len(src_pts)
+        return self._feature_match(entry, M)
+
+    @staticmethod
+    def _feature_match(entry, M):
+        """Build the match tuple for the affine transform ``M`` of the template into the frame."""
+        h, w = entry.gray.shape
         pts = np.float32([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]])
         dst = cv2.transform(pts[None, :, :], M)[0]
         x_coords = dst[:, 0]
@@ -112,19 +695,144 @@ class KeyleFinderModule:
         bottom_right = (int(max(x_coords)), int(max(y_coords)))
         angle = float(np.degrees(np.arctan2(M[1, 0], M[0, 0])))
         scale = float(np.sqrt(M[0, 0] ** 2 + M[1, 0] ** 2))
-        return top_left, bottom_right, angle, scale, single_image, dst.reshape(4, 2), M
+        return top_left, bottom_right, angle, scale, entry.image, dst.reshape(4, 2), M
+
+    @staticmethod
+    def _top_candidates(result, k, w, h, min_val=-1.0):
+        """Return up to ``k`` peak locations of ``result`` above ``min_val``, suppressing overlaps."""
+        result = result.copy()
+        peaks = []
+        for _ in range(k):
+            _, max_val, _, (x, y) = cv2.minMaxLoc(result)
+            if max_val <= -1 or max_val < min_val:
+                break
+            peaks.append((x, y))
+            result[max(0, y - h // 2):y + h // 2 + 1, max(0, x - w // 2):x + w // 2 + 1] = -1
+        return peaks
+
+    def _pyramid_level(self, entry, frame):
+        h, w = entry.gray.shape
+        fh, fw = frame.image.shape[:2]
+        level = self.pyramid_levels
+        while level > 0 and (min(h, w) >> level < TEMPLATE_MIN_SIDE or fw >> level <= w >> level
+                             or fh >> level <= h >> level):
+            level -= 1
+        return level
+
+    def _scale_order(self, hint):
+        """Return the configured scales plus ``hint``, the ones closest to ``hint`` first."""
+        scales = self.scales
+        if hint is None:
+            hint = 1.0
+        elif all(abs(s - hint) > SCALE_HINT_TOLERANCE * hint for s in scales):
+            scales = scales + (round(float(hint), 3),)
+        return sorted(scales, key=lambda s: abs(s - hint))
 
-    def _match_template(self, single_image_path, threshold: float = 0.8):
-        """Fallback template matching when feature matching fails."""
-        single_image = cv2.imread(single_image_path)
-        if single_image is None or self.big_image is None:
+    def _match_template(self, template, threshold: float = 0.8, frame=None, scale=None, all_scales=True):
+        """Fallback template matching when feature matching fails.
+
+        The template is tried at ``scale`` (1.0 by default) first; when that
+        misses and ``all_scales`` is set, every other configured scale is
+        tried and the best hit wins.  The reported scale is the one that
+        matched.
+        """
+        frame = self.frame if frame is None else frame
+        entry = self.registry.get(template)
+        if entry is None or frame.image is None:
+            return None
+        order = self._scale_order(scale)
+        best = self._match_scaled(entry.scaled(order[0]), frame, threshold)
+        if best is not None:
+            return best + (order[0],)
+        if not all_scales:
             return None
-        result = cv2.matchTemplate(self.big_image, single_image, cv2.TM_CCOEFF_NORMED)
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-        if max_val < threshold:
+        best, best_scale = None, None
+        for s in order[1:]:
+            with tracer.span('template.scale', scale=s):
+                hit = self._match_scaled(entry.scaled(s), frame, threshold)
+            if hit is not None and (best is None or hit[0] > best[0]):
+                best, best_scale = hit, s
+        return None if best is None else best + (best_scale,)
+
+    def _match_scaled(self, entry, frame, threshold):
+        """Match one size of a template; return ``(score, match)`` or ``None``."""
+        hits = self._template_hits(entry, frame, threshold)
+        if not hits:
             return None
-        h, w = single_image.shape[:2]
-        top_left = max_loc
+        score, top_left = hits[0]
+        return score, self._template_match(entry, top_left)
+
+    def _template_hits(self, entry, frame, threshold, limit=None):
+        """Return ``(score, top_left)`` hits of one template size, best first.
+
+        The template is first matched on a downscaled gray pyramid level and
+        the best ``TEMPLATE_TOP_K`` candidates are refined in small windows
+        of the frame in ``self.color_mode``, shrunk by ``self.downsample``.
+        Without downsampling the best hit equals a full-resolution
+        ``TM_CCOEFF_NORMED`` search.  With a ``limit`` every peak above
+        ``threshold`` (up to ``limit``) is returned instead of only the best;
+        coarse candidates then only need to reach
+        ``threshold - TEMPLATE_COARSE_MARGIN``.
+        """
+        h, w = entry.image.shape[:2]
+        fh, fw = frame.image.shape[:2]
+        down = self.downsample
+        if h > fh or w > fw or min(h, w) < 4 * down:
+            return []
+        tpl = entry.variant(self.color_mode, down)
+        image = frame.variant(self.color_mode, down)
+        th, tw = tpl.shape[:2]
+        ih, iw = image.shape[:2]
+        if th > ih or tw > iw:
+            return []
+        level = self._pyramid_level(entry, frame)
+        # size of one coarse pixel in pixels of the (downsampled) working image
+        factor = (1 << level) // down if (1 << level) % down == 0 else 1
+        peaks = []
+        if factor <= 1:
+            with tracer.span('template.full'):
+                result = cv2.matchTemplate(image, tpl, cv2.TM_CCOEFF_NORMED)
+                if limit is None:
+                    _, max_val, _, max_loc = cv2.minMaxLoc(result)
+                    peaks.append((max_val, max_loc))
+                else:
+                    peaks = [(float(result[y, x]), (x, y))
+                             for x, y in self._top_candidates(result, limit, tw, th, threshold)]
+        else:
+            coarse_tpl = entry.pyramid(level)
+            coarse_frame = frame.pyramid(level)
+            with tracer.span('template.coarse'):
+                coarse = cv2.matchTemplate(coarse_frame, coarse_tpl, cv2.TM_CCOEFF_NORMED)
+            if limit is None:
+                candidates = self._top_candidates(coarse, TEMPLATE_TOP_K, coarse_tpl.shape[1], coarse_tpl.shape[0])
+            else:
+                candidates = self._top_candidates(coarse, 2 * limit, coarse_tpl.shape[1], coarse_tpl.shape[0],
+                                                  threshold - TEMPLATE_COARSE_MARGIN)
+            pad = 2 * factor
+            max_val = -1.0
+            with tracer.span('template.refine'):
+                for cx, cy in candidates:
+                    x1 = max(0, cx * factor - pad)
+                    y1 = max(0, cy * factor - pad)
+                    x2 = min(iw, cx * factor + tw + pad)
+                    y2 = min(ih, cy * factor + th + pad)
+                    if x2 - x1 < tw or y2 - y1 < th:
+                        continue
+                    fine = cv2.matchTemplate(image[y1:y2, x1:x2], tpl, cv2.TM_CCOEFF_NORMED)
+                    _, val, _, loc = cv2.minMaxLoc(fine)
+                    if limit is not None:
+                        peaks.append((val, (x1 + loc[0], y1 + loc[1])))
+                    elif val > max_val:
+                        max_val = val
+                        peaks = [(val, (x1 + loc[0], y1 + loc[1]))]
+        hits = [(val, (loc[0] * down, loc[1] * down)) for val, loc in peaks if val >= threshold]
+        hits.sort(key=lambda hit: -hit[0])
+        return hits
+
+    @staticmethod
+    def _template_match(entry, top_left, scale=1.0):
+        """Build the match tuple for a template hit at ``top_left``."""
+        h, w = entry.image.shape[:2]
         bottom_right = (top_left[0] + w, top_left[1] + h)
         dst = np.float32([
             [top_left[0], top_left[1]],
@@ -133,17 +841,100 @@ class KeyleFinderModule:
             [top_left[0], top_left[1] + h - 1],
         ])
         transform = np.float32([[1, 0, top_left[0]], [0, 1, top_left[1]]])
-        return top_left, bottom_right, 0.0, 1.0, single_image, dst, transform
+        return top_left, bottom_right, 0.0, scale, entry.image, dst, transform
 
-    def locate(self, sub_image_path: str, debug: bool = False):
-        match = self._match_feature(sub_image_path)
+    @staticmethod
+    def _offset_match(match, origin):
+        """Translate a match found in a cropped frame back to screen coordinates."""
+        ox, oy = origin
+        if ox == 0 and oy == 0:
+            return match
+        top_left, bottom_right, angle, scale, img, pts, M = match
+        M = np.array(M, dtype=np.float64)
+        M[0, 2] += ox
+        M[1, 2] += oy
+        return ((top_left[0] + ox, top_left[1] + oy), (bottom_right[0] + ox, bottom_right[1] + oy),
+                angle, scale, img, pts + np.float32([ox, oy]), M)
+
+    def _match_in(self, entry, frame, scale=None, all_scales=True, info=None):
+        """Run feature then template matching on ``frame``.
+
+        ``info`` collects the result metadata described in :meth:`locate`;
+        phase times are added to ``info['timings']``.
+        """
+        info = {} if info is None else info
+        timings = info.setdefault('timings', {})
+        start = time.perf_counter()
+        with tracer.span('locate.feature'):
+            match = self._match_feature(entry, frame, info)
+        now = time.perf_counter()
+        timings['feature'] = timings.get('feature', 0.0) + (now - start) * 1000.0
+        if match is not None:
+            info['engine'] = 'feature'
+            info['score'] = info['inlier_ratio']
+        else:
+            with tracer.span('locate.template'):
+                hit = self._match_template(entry, frame=frame, scale=scale, all_scales=all_scales)
+            timings['template'] = timings.get('template', 0.0) + (time.perf_counter() - now) * 1000.0
+            if hit is not None:
+                score, (top_left, bottom_right, angle, _, img, pts, M), chosen = hit
+                match = top_left, bottom_right, angle, chosen, img, pts, M
+                info.update(engine='template', score=float(score))
+                info.pop('inliers', None)
+                info.pop('inlier_ratio', None)
         if match is None:
-            match = self._match_template(sub_image_path)
+            return None
+        return self._offset_match(match, frame.origin)
+
+    def _roi_windows(self, roi):
+        """Yield padded windows around ``roi`` from the tightest to the widest."""
+        h, w = self.big_image.shape[:2]
+        ox, oy = self.frame.origin
+        x1, y1, x2, y2 = roi[0] - ox, roi[1] - oy, roi[2] - ox, roi[3] - oy
+        size = max(x2 - x1, y2 - y1, 1)
+        for factor in ROI_PADDING:
+            pad = int(size * factor) + 8
+            window = (max(0, x1 - pad), max(0, y1 - pad), min(w, x2 + pad), min(h, y2 + pad))
+            if window == (0, 0, w, h):
+                return
+            if window[2] > window[0] and window[3] > window[1]:
+                yield window
+
+    def locate(self, sub_image, debug: bool = False, roi=None, scale=None):
+        """Find ``sub_image`` (anything :meth:`TemplateRegistry.get` accepts).
+
+        ``roi`` is an optional ``(x1, y1, x2, y2)`` rectangle, usually the last
+        hit of the same template.  Padded windows around it are searched first
+        and the full frame only when all of them miss.  ``scale`` is the
+        template scale to try first, usually the ``scale`` of the last hit;
+        the ROI windows only try that scale.
+
+        Besides the rectangle and ``scale`` a hit reports ``score`` (the
+        RANSAC inlier ratio for feature hits, the ``TM_CCOEFF_NORMED`` value
+        for template hits), ``engine`` (``'feature'`` or ``'template'``),
+        ``angle`` in degrees, ``inliers`` and ``inlier_ratio`` for feature
+        hits, and ``timings`` in milliseconds per phase plus ``'total'``.
+        Misses report ``timings`` only.
+        """
+        start = time.perf_counter()
+        entry = self.registry.get(sub_image)
+        match = None
+        info = {'timings': {}}
+        if entry is not None and self.big_image is not None:
+            if roi is not None:
+                for window in self._roi_windows(roi):
+                    match = self._match_in(entry, self.frame.crop(*window), scale, all_scales=False, info=info)
+                    if match is not None:
+                        break
             if match is None:
-                result = {"status": 1}
-                if debug:
-                    self._show_preview(label=json.dumps(result, ensure_ascii=False), found=False)
-                return result
+                match = self._match_in(entry, self.frame, scale, info=info)
+        timings = {name: round(ms, 3) for name, ms in info['timings'].items()}
+        timings['total'] = round((time.perf_counter() - start) * 1000.0, 3)
+        if match is None:
+            result = {"status": 1, "timings": timings}
+            if debug:
+                self._show_preview(label=json.dumps(result, ensure_ascii=False), found=False)
+            return result
 
         top_left, bottom_right, angle, scale, img, pts, M = match
         result = {
@@ -151,7 +942,111 @@ class KeyleFinderModule:
             "top_left": [top_left[0], top_left[1]],
             "bottom_right": [bottom_right[0], bottom_right[1]],
             "scale": scale,
+            "score": info['score'],
+            "engine": info['engine'],
+            "angle": angle,
         }
+        if 'inliers' in info:
+            result["inliers"] = info['inliers']
+            result["inlier_ratio"] = info['inlier_ratio']
+        result["timings"] = timings
         if debug:
+            ox, oy = self.frame.origin
+            _, _, _, _, _, pts, M = self._offset_match(match, (-ox, -oy))
             self._show_preview(img, pts, angle, scale, label=json.dumps(result, ensure_ascii=False), transform=M, found=True)
         return result
+
+    def _feature_instances(self, entry, frame, limit):
+        """Split feature correspondences into instances with sequential RANSAC."""
+        des1 = entry.features(self.orb_profile)[1]
+        des2 = frame.detect(self.orb_profile)[1]
+        if des1 is None or des2 is None:
+            return []
+        with tracer.span('orb.knn_match'):
+            distances, indices = frame.knn_match(des1, self.matcher, k=min(LOCATE_ALL_KNN, len(des2)),
+                                                 profile=self.orb_profile)
+            query, nth = np.nonzero((indices >= 0) & (distances <= FEATURE_MAX_DISTANCE))
+        src = entry.points(self.orb_profile)[query]
+        dst = frame.points(self.orb_profile)[indices[query, nth]]
+        instances = []
+        while len(src) >= FEATURE_MIN_INLIERS and len(instances) < limit:
+            with tracer.span('orb.ransac'):
+                M, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC)
+            if M is None:
+                break
+            inliers = inliers.ravel().astype(bool)
+            matched = len(np.unique(query[inliers]))
+            if matched < max(FEATURE_MIN_INLIERS, FEATURE_MIN_SCORE * len(des1)):
+                break
+            match = self._feature_match(entry, M)
+            if 0.25 <= match[3] <= 4.0:
+                instances.append((matched / len(des1), match))
+            # drop this instance's inliers and every correspondence landing inside it
+            (x1, y1), (x2, y2) = match[0], match[1]
+            inside = (dst[:, 0] >= x1) & (dst[:, 0] <= x2) & (dst[:, 1] >= y1) & (dst[:, 1] <= y2)
+            keep = ~(inliers | inside)
+            src, dst, query = src[keep], dst[keep], query[keep]
+        return instances
+
+    def _template_instances(self, entry, frame, threshold, limit, scale=None):
+        """Return every template hit at the best-scoring scale (the hinted scale when it hits)."""
+        best, best_scale = [], None
+        for i, s in enumerate(self._scale_order(scale)):
+            hits = self._template_hits(entry.scaled(s), frame, threshold, limit)
+            if hits and (not best or hits[0][0] > best[0][0]):
+                best, best_scale = hits, s
+            if i == 0 and hits:
+                break
+        return [(score, self._template_match(entry.scaled(best_scale), top_left, best_scale))
+                for score, top_left in best]
+
+    def locate_all(self, sub_image, threshold: float = 0.8, max_results=LOCATE_ALL_MAX, scale=None,
+                   debug: bool = False):
+        """Find every instance of ``sub_image`` in one pass over the frame.
+
+        Feature correspondences are split into instances by sequential
+        RANSAC, and every peak of the template response map above
+        ``threshold`` is kept.  Overlapping hits of both are merged by
+        non-maximum suppression.  Returns a list of :meth:`locate` style
+        results with ``score``, ``engine`` and ``angle``, best first.
+        """
+        entry = self.registry.get(sub_image)
+        if entry is None or self.big_image is None:
+            return []
+        with tracer.span('locate.feature'):
+            features = self._feature_instances(entry, self.frame, max_results)
+        with tracer.span('locate.template'):
+            hits = features + self._template_instances(entry, self.frame, threshold, max_results, scale)
+        feature_ids = {id(match) for _, match in features}
+        kept = non_max_suppression(hits)[:max_results]
+        results = []
+        for score, match in kept:
+            top_left, bottom_right, angle, match_scale = self._offset_match(match, self.frame.origin)[:4]
+            results.append({
+                "status": 0,
+                "top_left": [top_left[0], top_left[1]],
+                "bottom_right": [bottom_right[0], bottom_right[1]],
+                "scale": match_scale,
+                "score": float(score),
+                "engine": "feature" if id(match) in feature_ids else "template",
+                "angle": angle,
+            })
+        if debug:
+            preview = self.big_image.copy()
+            for _, match in kept:
+                cv2.polylines(preview, [np.int32(match[5])], True, (0, 255, 0), 2)
+            self._draw_multiline_text(preview, f'{len(results)} matches', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7,
+                                      (0, 0, 255), 2)
+            cv2.imshow('Located Image', preview)
+            cv2.waitKey(0)
+            cv2.destroyAllWindows()
+        return results
+
+    def locate_many(self, templates, debug: bool = False, rois=None):
+        """Locate every template against this frame, reusing its features.
+
+        ``rois`` optionally gives one ``roi`` (or ``None``) per template.
+        Returns a list of :meth:`locate` results in the order of ``templates``.
+        """
+        rois = [None] * len(templates) if rois is None else rois
+        return [self.locate(template, debug=debug, roi=roi) for template, roi in zip(templates, rois)]
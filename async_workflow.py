@@ -0,0 +1,251 @@
+"""asyncio engine running several workflows (item groups) side by side.
+
+Typical use is one main sequence plus a few watchers for dialogs that may pop
+up at any time::
+
+    run_concurrent([
+        {'name': 'main', 'items': load_items('main.json')},
+        {'name': 'dialogs', 'items': load_items('dialogs.json'), 'loop': True},
+    ])
+
+All groups share one capture stream (a frame younger than ``max_frame_age``
+is reused instead of grabbing a new one) and one thread pool for matching,
+while mouse actions are serialised so groups never click over each other.
+Looping groups are cancelled once every non-looping group has finished.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from autoclick_api import (WAIT_POLL_MAX, WAIT_POLL_MIN, WAIT_TIMEOUT, MatchStats, locate_all_on_monitors,
+                           locate_on_monitors, move_mouse, prepare_items, pyautogui)
+from frame_source import create_frame_source
+from tracing import tracer
+
+
+class SharedCapture:
+    """Hand the same recent per-monitor frames to every group instead of capturing per request."""
+
+    def __init__(self, source, executor, max_age=0.05):
+        self.source = source
+        self.executor = executor
+        self.max_age = max_age
+        self._lock = asyncio.Lock()
+        self._frames = None
+        self._time = 0.0
+        self._fresh_after = 0.0
+
+    async def frames(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._frames is None or now - self._time > self.max_age or self._time < self._fresh_after:
+                started = time.monotonic()
+                with tracer.span('capture'):
+                    self._frames = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, self.source.monitor_frames)
+                self._time = started
+            return self._frames
+
+    def invalidate(self):
+        """Stop handing out frames captured before now (called after every action)."""
+        self._fresh_after = time.monotonic()
+        self.source.invalidate()
+
+
+class ActionSerializer:
+    """Run mouse actions one at a time and keep track of an active long press.
+
+    Every pyautogui call blocks (at least ``pyautogui.PAUSE``), so each one
+    runs on ``executor``; the lock keeps one group's move and click together
+    while other groups go on matching.
+    """
+
+    def __init__(self, capture, executor=None):
+        self.capture = capture
+        self.executor = executor
+        self._lock = asyncio.Lock()
+        self._long_press = None  # (group name, position)
+
+    async def _act(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    async def release_if_moved(self):
+        async with self._lock:
+            if self._long_press and await self._act(pyautogui.position) != self._long_press[1]:
+                await self._act(pyautogui.mouseUp)
+                self._long_press = None
+
+    async def release(self, group=None):
+        """Release a long press held by ``group`` (or by anyone when ``None``)."""
+        async with self._lock:
+            if self._long_press and (group is None or self._long_press[0] == group):
+                await self._act(pyautogui.mouseUp)
+                self._long_press = None
+
+    async def click(self, group, x, y, action):
+        await self.click_all(group, [(x, y)], action)
+
+    async def click_all(self, group, points, action):
+        """Click every ``(x, y)`` in ``points`` without another group's action in between."""
+        async with self._lock:
+            if self._long_press:
+                await self._act(pyautogui.mouseUp)
+                self._long_press = None
+            with tracer.span('click', group=group):
+                for x, y in points:
+                    await self._act(move_mouse, x, y)
+                    if action == 'double':
+                        await self._act(pyautogui.click, clicks=2)
+                    elif action == 'long':
+                        await self._act(pyautogui.mouseDown)
+                        self._long_press = (group, await self._act(pyautogui.position))
+                    else:
+                        await self._act(pyautogui.click)
+            self.capture.invalidate()
+
+
+async def _frames(ctx, item):
+    frames = await ctx['capture'].frames()
+    monitor = item.get('monitor')
+    if monitor:
+        if not 1 <= monitor <= len(frames):
+            raise ValueError(f'Monitor {monitor} does not exist, found {len(frames)}')
+        frames = frames[monitor - 1:monitor]
+    return frames
+
+
+async def _locate(ctx, item):
+    frames = await _frames(ctx, item)
+    loop = asyncio.get_running_loop()
+    with tracer.span('locate'):
+        return await loop.run_in_executor(ctx['executor'], locate_on_monitors, frames, item, False,
+                                          ctx['skip_unchanged'])
+
+
+async def _locate_all(ctx, item):
+    frames = await _frames(ctx, item)
+    loop = asyncio.get_running_loop()
+    with tracer.span('locate'):
+        return await loop.run_in_executor(ctx['executor'], locate_all_on_monitors, frames, item)
+
+
+async def _wait_for(ctx, item, locate=_locate, found=lambda result: result.get('status') == 0):
+    deadline = time.monotonic() + item.get('timeout', WAIT_TIMEOUT) / 1000.0
+    pause = WAIT_POLL_MIN
+    while True:
+        result = await locate(ctx, item)
+        now = time.monotonic()
+        if found(result) or now >= deadline:
+            return result
+        await asyncio.sleep(min(pause, deadline - now))
+        pause = min(WAIT_POLL_MAX, pause * 2)
+
+
+async def run_group(ctx, group):
+    """Run one group's items with the same semantics as :func:`autoclick_api.run_workflow`.
+
+    As there, ``match_all`` items click every instance of their template
+    and ignore ``skip_unchanged``.
+    """
+    items = group['items']
+    name = group.get('name', '')
+    actions = ctx['actions']
+    try:
+        while True:
+            idx = 0
+            while idx < len(items):
+                item = items[idx]
+                if not item.get('enable', True):
+                    idx += 1
+                    continue
+                await actions.release_if_moved()
+                if item.get('action') != 'long':
+                    await actions.release(name)
+                started = time.monotonic()
+                with tracer.span('step', group=name, index=idx, alias=item.get('alias', '')):
+                    if item.get('match_all'):
+                        if item.get('wait_until_visible'):
+                            hits = await _wait_for(ctx, item, _locate_all, bool)
+                        else:
+                            hits = await _locate_all(ctx, item)
+                        result = hits[0] if hits else {'status': 1}
+                    else:
+                        if item.get('wait_until_visible'):
+                            result = await _wait_for(ctx, item)
+                        else:
+                            result = await _locate(ctx, item)
+                        hits = [result]
+                ctx['stats'].record(item, result)
+                if result.get('status') == 0:
+                    tl = result['top_left']
+                    br = result['bottom_right']
+                    item['last_rect'] = [tl[0], tl[1], br[0], br[1]]
+                    item['last_scale'] = result['scale']
+                    if item.get('action') == 'long':
+                        hits = hits[:1]
+                    points = [((r['top_left'][0] + r['bottom_right'][0]) // 2,
+                               (r['top_left'][1] + r['bottom_right'][1]) // 2) for r in hits]
+                    await actions.click_all(name, points, item.get('action'))
+                    idx += 1
+                elif item.get('interrupt'):
+                    idx = 0
+                else:
+                    idx += 1
+                delay = item.get('delay', 0) / 1000.0
+                if item.get('wait_until_visible'):
+                    # time spent waiting for the item counts toward its delay
+                    delay = max(0.0, delay - (time.monotonic() - started))
+                await asyncio.sleep(delay)
+            await actions.release(name)
+            if not group.get('loop', False):
+                break
+            await asyncio.sleep(group.get('interval', 0.5))
+    finally:
+        await actions.release(name)
+
+
+async def run_groups(groups, capture=None, workers=None, skip_unchanged=False, max_frame_age=0.05, stats=None):
+    """Run ``groups`` concurrently; see the module docstring for the group format.
+
+    A group may also be a plain item list, which runs once.  Step results
+    of all groups are recorded in ``stats``, which is returned.
+    """
+    stats = MatchStats() if stats is None else stats
+    groups = [g if isinstance(g, dict) else {'items': g} for g in groups]
+    source = create_frame_source(capture)
+    try:
+        for group in groups:
+            prepare_items(group['items'], source)
+    except BaseException:
+        if source is not capture:
+            source.close()
+        raise
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='autoclick-async')
+    # one thread for the mouse so clicks never queue behind matching
+    action_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='autoclick-actions')
+    capture_stream = SharedCapture(source, executor, max_frame_age)
+    ctx = {
+        'capture': capture_stream,
+        'actions': ActionSerializer(capture_stream, action_executor),
+        'executor': executor,
+        'skip_unchanged': skip_unchanged,
+        'stats': stats,
+    }
+    tasks = [asyncio.ensure_future(run_group(ctx, g)) for g in groups]
+    finite = [t for t, g in zip(tasks, groups) if not g.get('loop', False)]
+    try:
+        await asyncio.gather(*(finite or tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        executor.shutdown()
+        action_executor.shutdown()
+        if source is not capture:
+            source.close()
+    return stats
+
+
+def run_concurrent(groups, **kwargs):
+    """Blocking wrapper around :func:`run_groups`."""
+    return asyncio.run(run_groups(groups, **kwargs))
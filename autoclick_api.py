@@ -1,11 +1,18 @@
-import os
 import sys
 import json
 import base64
-import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
 import pyautogui
-from KeyleFinderModule import KeyleFinderModule
+import KeyleFinderModule as finder_module
+from KeyleFinderModule import KeyleFinderModule, ROI_PADDING, TemplateEntry, template_registry
+from change_detect import TileHasher
+from frame_source import CaptureThread, FrameSource, create_frame_source
+from tracing import tracer
+from workflow_pack import WorkflowPack, is_pack
 
 if sys.platform == 'darwin':
     from pynput.mouse import Controller as _Mouse
@@ -17,46 +24,420 @@ else:
     def move_mouse(x: int, y: int) -> None:
         pyautogui.moveTo(x, y)
 
+# wait_until_visible items: default timeout in ms, and the range of the pause
+# between re-matches in seconds (it doubles after every miss)
+WAIT_TIMEOUT = 10000
+WAIT_POLL_MIN = 0.01
+WAIT_POLL_MAX = 0.25
+
+_tile_hasher = TileHasher()
+_monitor_pool = None
+_template_lock = threading.Lock()
+
+def _make_item(entry, path, template=None):
+    item = {
+        'path': path,
+        'alias': entry.get('alias', ''),
+        'action': entry.get('action', 'single' if not entry.get('double_click') else 'double'),
+        'delay': entry.get('delay', 0),
+        'interrupt': entry.get('interrupt', False),
+        'enable': entry.get('enable', True),
+        'wait_until_visible': entry.get('wait_until_visible', False),
+        'timeout': entry.get('timeout', WAIT_TIMEOUT),
+        'monitor': entry.get('monitor'),
+        'color_mode': entry.get('color_mode'),
+        'downsample': entry.get('downsample'),
+        'orb_profile': entry.get('orb_profile'),
+        'match_all': entry.get('match_all', False),
+        'scales': entry.get('scales'),
+        'dpi_scale': entry.get('dpi_scale')
+    }
+    if template is not None:
+        item['template'] = template
+    return item
+
 def load_items(config_path: str):
-    """Load workflow items from a JSON configuration."""
+    """Load workflow items from a JSON export or a binary workflow pack.
+
+    Embedded templates are decoded in memory and carried in
+    ``item['template']``; items from a pack hold a lazy view into the
+    memory-mapped file instead, and the pack itself in ``item['pack']``
+    until :func:`cleanup_items`.  Nothing is written to disk.
+    """
+    if is_pack(config_path):
+        pack = WorkflowPack(config_path)
+        items = [_make_item(entry, None, pack.template(i)) for i, entry in enumerate(pack.entries)]
+        for item in items:
+            item['pack'] = pack
+        return items
     with open(config_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     items = []
-    for entry in data:
+    for i, entry in enumerate(data):
         if 'image' in entry:
             img_data = base64.b64decode(entry['image'])
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-            tmp.write(img_data)
-            tmp.close()
-            path = tmp.name
+            image = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError(f'Item {i} in {config_path} has invalid image data')
+            items.append(_make_item(entry, None, image))
         else:
-            path = entry['path']
-        item = {
-            'path': path,
-            'alias': entry.get('alias', ''),
-            'action': entry.get('action', 'single' if not entry.get('double_click') else 'double'),
-            'delay': entry.get('delay', 0),
-            'interrupt': entry.get('interrupt', False),
-            'enable': entry.get('enable', True)
-        }
-        items.append(item)
+            items.append(_make_item(entry, entry['path']))
     return items
 
+def item_template(item):
+    """Return what to match for ``item``: its in-memory template or its path.
+
+    An in-memory template is replaced by its registry entry on first use, so
+    it is hashed once and stays cached until :func:`cleanup_items`.
+    """
+    template = item.get('template')
+    if template is None:
+        return item['path']
+    if not isinstance(template, TemplateEntry):
+        with _template_lock:
+            template = item['template']
+            if not isinstance(template, TemplateEntry):
+                entry = template_registry.acquire(template)
+                if entry is None:
+                    return template
+                item['template'] = template = entry
+    return template
+
+def prepare_items(items, source=None):
+    """Decode the templates of enabled items and precompute their scaled copies.
+
+    Run once before a workflow starts so the first search does not pay for
+    resizing.  With the capture ``source``, items recorded at another display
+    scaling (``dpi_scale``) get the ratio to the current one as their scale
+    hint until they first match.
+    """
+    screen_scale = source.dpi_scale() if source is not None else None
+    with tracer.span('prepare'):
+        for item in items:
+            if item.get('enable', True):
+                if screen_scale and item.get('dpi_scale'):
+                    item['dpi_ratio'] = round(screen_scale / item['dpi_scale'], 3)
+                entry = template_registry.get(item_template(item))
+                if entry is not None:
+                    scales = item.get('scales') or finder_module.TEMPLATE_SCALES
+                    hint = _scale_hint(item)
+                    entry.prepare(scales=tuple(scales) + ((hint,) if hint else ()),
+                                  color_mode=item.get('color_mode'), downsample=item.get('downsample'))
+                    entry.features(item.get('orb_profile'))
+
+def _scale_hint(item):
+    """Return the template scale to try first: the last hit's, else the DPI ratio since capture."""
+    return item.get('last_scale') or item.get('dpi_ratio')
+
+def _finder(frame, item):
+    """Build the matcher for ``item``, honouring its scales, colour mode, downsample and ORB profile."""
+    return KeyleFinderModule(frame, scales=item.get('scales'), color_mode=item.get('color_mode'),
+                             downsample=item.get('downsample'), orb_profile=item.get('orb_profile'))
+
 def cleanup_items(items):
-    """Remove temporary files created for items."""
+    """Release the in-memory templates held by items, their registry entries and packs."""
+    packs = []
     for item in items:
-        path = item['path']
-        if path.startswith(tempfile.gettempdir()) and os.path.exists(path):
-            os.unlink(path)
+        _release_template(item.pop('template', None))
+        pack = item.pop('pack', None)
+        if pack is not None and all(p is not pack for p in packs):
+            packs.append(pack)
+    for pack in packs:
+        pack.close()
+
+def _release_template(template):
+    if isinstance(template, TemplateEntry):
+        template_registry.release(template)
+    elif isinstance(template, memoryview):
+        template.release()
+
+def locate_in_frame(frame, item, debug=False, skip_unchanged=False, state=None):
+    """Locate ``item`` in a full-screen ``frame``.
+
+    With ``skip_unchanged`` the frame's tile signature is compared with the
+    one from the item's previous match in this frame's ``state``.  An
+    unchanged screen, or a previous hit whose own tiles did not change,
+    reuses the previous result; a previous miss is re-checked only around
+    each cluster of changed tiles (or on the whole frame when those windows
+    would cover more of it).  That bookkeeping is kept in ``state`` (the
+    item itself by default).
+    """
+    if state is None:
+        state = item
+    template = item_template(item)
+    roi = item.get('last_rect')
+    scale = _scale_hint(item)
+    if not skip_unchanged:
+        return _finder(frame, item).locate(template, debug=debug, roi=roi, scale=scale)
+    with tracer.span('change.detect'):
+        signature = _tile_hasher.signature(frame.gray)
+    previous = state.get('last_signature')
+    last = state.get('last_result')
+    result = None
+    if (previous is not None and last is not None and previous.shape == signature.shape
+            and state.get('last_origin') == frame.origin):
+        dirty = _tile_hasher.dirty_rects(previous, signature, frame.origin)
+        # check the cached hit's own tiles: item['last_rect'] may be on another monitor
+        if not dirty or (last.get('status') == 0 and not _tile_hasher.changed_in(
+                previous, signature, last['top_left'] + last['bottom_right'], frame.origin)):
+            result = dict(last, timings={})
+            if result.get('status') == 0:
+                result['engine'] = 'cached'
+        elif last.get('status') != 0:
+            result = _locate_in_windows(frame, item, dirty, debug=debug, scale=scale)
+    if result is None:
+        result = _finder(frame, item).locate(template, debug=debug, roi=roi, scale=scale)
+    state['last_signature'] = signature
+    state['last_origin'] = frame.origin
+    state['last_result'] = result
+    return result
+
+def _locate_in_windows(frame, item, rects, debug=False, scale=None):
+    """Locate ``item`` in windows of ``frame`` around each changed screen rectangle in ``rects``.
+
+    Returns the first hit, the last miss, or ``None`` when the windows
+    together would cover at least the whole frame.
+    """
+    template = item_template(item)
+    entry = template_registry.get(template)
+    if entry is None:
+        return None
+    h, w = entry.image.shape[:2]
+    fh, fw = frame.image.shape[:2]
+    ox, oy = frame.origin
+    windows = [(max(0, x1 - w - ox), max(0, y1 - h - oy), min(fw, x2 + w - ox), min(fh, y2 + h - oy))
+               for x1, y1, x2, y2 in rects]
+    if sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in windows) >= fw * fh:
+        return None
+    result = None
+    for window in windows:
+        result = _finder(frame.crop(*window), item).locate(template, debug=debug, scale=scale)
+        if result.get('status') == 0:
+            break
+    return result
+
+def _contains(frame, rect):
+    h, w = frame.image.shape[:2]
+    ox, oy = frame.origin
+    return ox <= rect[0] < ox + w and oy <= rect[1] < oy + h
+
+def locate_on_monitors(frames, item, debug=False, skip_unchanged=False):
+    """Locate ``item`` in per-monitor ``frames`` (see :meth:`FrameSource.monitor_frames`).
+
+    The monitor holding the item's previous hit is searched first; the
+    others are then matched in parallel and the first hit in monitor order
+    wins.  Results are in global screen coordinates.
+    """
+    if len(frames) == 1:
+        return locate_in_frame(frames[0], item, debug=debug, skip_unchanged=skip_unchanged)
+    global _monitor_pool
+    states = item.setdefault('monitor_state', {})
+    roi = item.get('last_rect')
+    frames = sorted(frames, key=lambda f: not (roi is not None and _contains(f, roi)))
+
+    def match(frame):
+        return locate_in_frame(frame, item, debug=debug, skip_unchanged=skip_unchanged,
+                               state=states.setdefault(frame.origin, {}))
+
+    result = match(frames[0])
+    if result.get('status') == 0:
+        return result
+    if debug:
+        # preview windows must be opened from this thread
+        results = [match(f) for f in frames[1:]]
+    else:
+        if _monitor_pool is None:
+            _monitor_pool = ThreadPoolExecutor(thread_name_prefix='autoclick-monitor')
+        results = list(_monitor_pool.map(match, frames[1:]))
+    return next((r for r in results if r.get('status') == 0), result)
+
+def locate_item(source, item, debug=False, region_grab=False, skip_unchanged=False):
+    """Capture a frame from ``source`` and locate ``item`` in it.
 
-def run_workflow(items, debug=False, loop=False, interval=0.5):
-    """Execute the workflow items until completion or interruption."""
+    The search starts around the item's previous hit, at the template scale
+    of that hit.  With ``region_grab``
+    only a window around that hit is captured first, and the whole screen is
+    grabbed only when the template is not found there.  Otherwise every
+    monitor (or only ``item['monitor']`` when the item is pinned to one) is
+    searched.  ``skip_unchanged`` enables the change detection described in
+    :func:`locate_in_frame`.
+    """
+    roi = item.get('last_rect')
+    result = None
+    if region_grab and roi is not None:
+        pad = int(max(roi[2] - roi[0], roi[3] - roi[1]) * ROI_PADDING[-1]) + 8
+        with tracer.span('capture.region'):
+            frame = source.frame((roi[0] - pad, roi[1] - pad, roi[2] + pad, roi[3] + pad))
+        with tracer.span('locate'):
+            result = _finder(frame, item).locate(item_template(item), roi=roi, scale=_scale_hint(item))
+        if result.get('status') == 0:
+            # the cached full-frame result no longer describes this hit
+            item.pop('last_signature', None)
+            item.pop('monitor_state', None)
+    if result is None or result.get('status') != 0:
+        with tracer.span('capture'):
+            frames = source.monitor_frames(item.get('monitor'))
+        with tracer.span('locate'):
+            result = locate_on_monitors(frames, item, debug=debug, skip_unchanged=skip_unchanged)
+    if result.get('status') == 0:
+        tl = result['top_left']
+        br = result['bottom_right']
+        item['last_rect'] = [tl[0], tl[1], br[0], br[1]]
+        item['last_scale'] = result['scale']
+    return result
+
+def locate_all_on_monitors(frames, item, debug=False):
+    """Return every instance of ``item`` in per-monitor ``frames``.
+
+    The hits of all monitors are returned in reading order (top to bottom,
+    then left to right); see :meth:`KeyleFinderModule.locate_all`.
+    """
+    hits = []
+    for frame in frames:
+        hits += _finder(frame, item).locate_all(item_template(item), scale=_scale_hint(item), debug=debug)
+    hits.sort(key=lambda r: (r['top_left'][1], r['top_left'][0]))
+    return hits
+
+def locate_all_item(source, item, debug=False):
+    """Capture a frame from ``source`` and return every instance of ``item``.
+
+    Every monitor (or only ``item['monitor']``) is captured in full; see
+    :func:`locate_all_on_monitors`.
+    """
+    with tracer.span('capture'):
+        frames = source.monitor_frames(item.get('monitor'))
+    with tracer.span('locate'):
+        return locate_all_on_monitors(frames, item, debug=debug)
+
+def _sleep(seconds, stop=None):
+    """Sleep for ``seconds``, returning ``True`` early once the ``stop`` event is set."""
+    if stop is None:
+        time.sleep(seconds)
+        return False
+    return stop.wait(seconds)
+
+def _poll(item, attempt, found, stop=None):
+    """Call ``attempt(last)`` until ``found`` accepts its result or ``item``'s timeout expires.
+
+    ``last`` is true for the final attempt.  The pause between attempts
+    starts at ``WAIT_POLL_MIN`` and doubles up to ``WAIT_POLL_MAX``, so a
+    template that shows up quickly is caught almost immediately while a
+    long wait does not spin the CPU.  Setting the ``stop`` event ends the
+    wait with the last miss.
+    """
+    deadline = time.monotonic() + item.get('timeout', WAIT_TIMEOUT) / 1000.0
+    pause = WAIT_POLL_MIN
+    while True:
+        last = time.monotonic() >= deadline
+        result = attempt(last)
+        if found(result) or last:
+            return result
+        with tracer.span('wait'):
+            if _sleep(max(0.0, min(pause, deadline - time.monotonic())), stop):
+                return result
+        pause = min(WAIT_POLL_MAX, pause * 2)
+
+def wait_for_item(source, item, debug=False, region_grab=False, skip_unchanged=False, stop=None):
+    """Re-capture and re-match ``item`` until it appears or its timeout expires (see :func:`_poll`)."""
+    return _poll(item, lambda last: locate_item(source, item, debug=debug and last, region_grab=region_grab,
+                                                skip_unchanged=skip_unchanged),
+                 lambda result: result.get('status') == 0, stop)
+
+def wait_for_all(source, item, debug=False, stop=None):
+    """Like :func:`wait_for_item`, but return every instance from the first frame holding one."""
+    return _poll(item, lambda last: locate_all_item(source, item, debug=debug and last), bool, stop)
+
+class MatchStats:
+    """Aggregate the match metadata of :meth:`KeyleFinderModule.locate` results per item.
+
+    Rows are kept per item object, so items sharing an alias or path (or,
+    like embedded pack items, having neither) are counted separately.
+    """
+
+    def __init__(self):
+        self.items = {}  # id(item) -> row; the row holds the item so its id is not reused
+
+    def record(self, item, result):
+        s = self.items.get(id(item))
+        if s is None:
+            label = item.get('alias') or item.get('path') or f'item {len(self.items) + 1}'
+            s = self.items[id(item)] = {'item': item, 'label': label, 'hits': 0, 'misses': 0, 'scores': [],
+                                        'engines': {}, 'total_ms': 0.0}
+        s['total_ms'] += result.get('timings', {}).get('total', 0.0)
+        if result.get('status') != 0:
+            s['misses'] += 1
+            return
+        s['hits'] += 1
+        engine = result.get('engine', '')
+        s['engines'][engine] = s['engines'].get(engine, 0) + 1
+        if engine != 'cached' and result.get('score') is not None:
+            s['scores'].append(result['score'])
+
+    def summary(self):
+        """Return ``{label: {hits, misses, min_score, mean_score, engines, total_ms}}``.
+
+        The label is the item's alias or path; a repeated label gets the
+        row number appended.
+        """
+        stats = {}
+        for n, s in enumerate(self.items.values(), 1):
+            scores = s['scores']
+            name = s['label'] if s['label'] not in stats else f"{s['label']} #{n}"
+            stats[name] = {
+                'hits': s['hits'],
+                'misses': s['misses'],
+                'min_score': min(scores) if scores else None,
+                'mean_score': sum(scores) / len(scores) if scores else None,
+                'engines': dict(s['engines']),
+                'total_ms': s['total_ms'],
+            }
+        return stats
+
+    def format_summary(self):
+        """Return :meth:`summary` as a text table, lowest mean score first."""
+        stats = self.summary()
+        header = f"{'item':<24}{'hits':>6}{'misses':>8}{'min':>7}{'mean':>7}{'total ms':>11}  engines"
+        lines = [header, '-' * len(header)]
+        for name, s in sorted(stats.items(), key=lambda kv: -1.0 if kv[1]['mean_score'] is None else kv[1]['mean_score']):
+            low = '-' if s['min_score'] is None else f"{s['min_score']:.2f}"
+            mean = '-' if s['mean_score'] is None else f"{s['mean_score']:.2f}"
+            engines = ' '.join(f'{k}={v}' for k, v in sorted(s['engines'].items()))
+            lines.append(f"{name[:24]:<24}{s['hits']:>6}{s['misses']:>8}{low:>7}{mean:>7}"
+                         f"{s['total_ms']:>11.1f}  {engines}")
+        return '\n'.join(lines)
+
+
+def run_workflow(items, debug=False, loop=False, interval=0.5, cleanup=True, capture=None, region_grab=False,
+                 background_capture=False, skip_unchanged=False, stats=None, stop=None):
+    """Execute the workflow items until completion or interruption.
+
+    Pass ``cleanup=False`` to keep the items (and their decoded templates)
+    for another run, e.g. when a long-running process caches loaded workflows.
+    ``capture`` is a :class:`FrameSource` or a backend name understood by
+    :func:`create_frame_source`.  With ``background_capture`` frames are
+    grabbed by a :class:`CaptureThread` while the previous step is matched.
+    ``skip_unchanged`` reuses an item's previous result when the screen did
+    not change since its last match.  Items with ``match_all`` click every
+    instance of their template (a long press only holds the first one); they
+    always search every monitor in full, so ``region_grab`` and
+    ``skip_unchanged`` do not apply to them, and with ``wait_until_visible``
+    the instances are taken from the frame that first shows one.
+    Every step's result is recorded in ``stats`` (a new :class:`MatchStats`
+    by default), which is returned.  Setting the ``stop`` event (a
+    :class:`threading.Event`) ends the run after the current step.
+    """
+    stats = MatchStats() if stats is None else stats
+    source = create_frame_source(capture)
+    owns_source = not isinstance(capture, FrameSource)
+    if background_capture:
+        source = CaptureThread(source)
     long_press_active = False
     long_press_pos = None
     try:
+        prepare_items(items, source)
         while True:
             idx = 0
-            while idx < len(items):
+            while idx < len(items) and not (stop is not None and stop.is_set()):
                 item = items[idx]
                 if not item.get('enable', True):
                     idx += 1
@@ -71,40 +452,64 @@ def run_workflow(items, debug=False, loop=False, interval=0.5):
                     pyautogui.mouseUp()
                     long_press_active = False
 
-                screenshot = pyautogui.screenshot()
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
-                    screenshot.save(tmp.name)
-                    screen_path = tmp.name
-                finder = KeyleFinderModule(screen_path)
-                result = finder.locate(item['path'], debug=debug)
-                if result.get('status') == 0:
-                    tl = result['top_left']
-                    br = result['bottom_right']
-                    center_x = (tl[0] + br[0]) // 2
-                    center_y = (tl[1] + br[1]) // 2
-                    move_mouse(center_x, center_y)
-                    if item.get('action') == 'double':
-                        pyautogui.click(clicks=2)
-                    elif item.get('action') == 'long':
-                        pyautogui.mouseDown()
-                        long_press_active = True
-                        long_press_pos = pyautogui.position()
+                started = time.monotonic()
+                with tracer.span('step', index=idx, alias=item.get('alias', '')):
+                    if item.get('match_all'):
+                        if item.get('wait_until_visible'):
+                            hits = wait_for_all(source, item, debug=debug, stop=stop)
+                        else:
+                            hits = locate_all_item(source, item, debug=debug)
+                        result = hits[0] if hits else {'status': 1}
                     else:
-                        pyautogui.click()
+                        if item.get('wait_until_visible'):
+                            result = wait_for_item(source, item, debug=debug, region_grab=region_grab,
+                                                   skip_unchanged=skip_unchanged, stop=stop)
+                        else:
+                            result = locate_item(source, item, debug=debug, region_grab=region_grab,
+                                                 skip_unchanged=skip_unchanged)
+                        hits = [result]
+                stats.record(item, result)
+                if result.get('status') == 0:
+                    if item.get('action') == 'long':
+                        hits = hits[:1]
+                    for hit in hits:
+                        tl = hit['top_left']
+                        br = hit['bottom_right']
+                        center_x = (tl[0] + br[0]) // 2
+                        center_y = (tl[1] + br[1]) // 2
+                        with tracer.span('click'):
+                            move_mouse(center_x, center_y)
+                            if item.get('action') == 'double':
+                                pyautogui.click(clicks=2)
+                            elif item.get('action') == 'long':
+                                pyautogui.mouseDown()
+                                long_press_active = True
+                                long_press_pos = pyautogui.position()
+                            else:
+                                pyautogui.click()
+                    source.invalidate()
                     idx += 1
                 else:
                     if item.get('interrupt'):
                         idx = 0
                     else:
                         idx += 1
-                os.unlink(screen_path)
                 delay = item.get('delay', 0) / 1000.0
-                time.sleep(delay)
+                if item.get('wait_until_visible'):
+                    # time spent waiting for the item counts toward its delay
+                    delay = max(0.0, delay - (time.monotonic() - started))
+                with tracer.span('delay'):
+                    _sleep(delay, stop)
             if long_press_active:
                 pyautogui.mouseUp()
                 long_press_active = False
-            if not loop:
+            if not loop or _sleep(interval, stop):
                 break
-            time.sleep(interval)
     finally:
-        cleanup_items(items)
+        if owns_source:
+            source.close()
+        elif background_capture:
+            source.stop()
+        if cleanup:
+            cleanup_items(items)
+    return stats
@@ -0,0 +1,277 @@
+"""Long-running AutoClick process answering requests over a Unix domain socket.
+
+The daemon keeps OpenCV, pyautogui, the decoded templates and loaded
+workflows warm, so every request costs milliseconds instead of a cold start::
+
+    python autoclick_daemon.py serve &
+    python autoclick_daemon.py locate button.png
+    python autoclick_daemon.py run workflow.json
+    python autoclick_daemon.py status
+    python autoclick_daemon.py cancel
+
+Requests and responses are single-line JSON objects.  The client commands
+only import the standard library.
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), 'autoclick.sock')
+# how long a locate request waits for the screen while a workflow runs
+SCREEN_WAIT = 1.0
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.autoclick.dispatch(json.loads(line))
+            except Exception as exc:
+                response = {'status': -1, 'error': f'{type(exc).__name__}: {exc}'}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class AutoClickDaemon:
+    """Serve ``locate``, ``run_workflow``, ``cancel`` and ``status`` requests.
+
+    One workflow runs at a time on a worker thread that holds the screen;
+    ``cancel`` and ``shutdown`` stop it through its stop event.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, capture=None, workers=0):
+        import autoclick_api
+        import KeyleFinderModule as finder_module
+        from frame_source import create_frame_source
+        self._api = autoclick_api
+        self._finder = finder_module
+        self.socket_path = socket_path
+        self.source = create_frame_source(capture)
+        self.matcher = None
+        if workers:
+            from parallel_match import ParallelMatcher
+            self.matcher = ParallelMatcher(workers)
+        # serialises screen capture and mouse actions between client threads
+        self._screen_lock = threading.Lock()
+        self._workflows = {}  # config path -> (mtime_ns, items)
+        self._workflows_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._run = None  # (worker thread, stop event) of the running workflow
+        self._closing = False
+        self._server = None
+        self.started = time.time()
+        self.requests = 0
+        self._requests_lock = threading.Lock()
+
+    def dispatch(self, request):
+        with self._requests_lock:
+            self.requests += 1
+        handler = getattr(self, 'cmd_' + str(request.get('cmd')), None)
+        if handler is None:
+            return {'status': -1, 'error': f"unknown command {request.get('cmd')!r}"}
+        return handler(request)
+
+    def _workflow(self, config):
+        mtime = os.stat(config).st_mtime_ns
+        with self._workflows_lock:
+            cached = self._workflows.get(config)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            if cached is not None:
+                self._api.cleanup_items(cached[1])
+            items = self._api.load_items(config)
+            self._workflows[config] = (mtime, items)
+            return items
+
+    def cmd_locate(self, request):
+        if not self._screen_lock.acquire(timeout=SCREEN_WAIT):
+            return {'status': -1, 'error': 'busy: a workflow is running'}
+        try:
+            frame = self.source.frame()
+        finally:
+            self._screen_lock.release()
+        options = {k: request.get(k) for k in ('color_mode', 'downsample', 'orb_profile')}
+        if 'templates' in request:
+            if self.matcher is not None:
+                templates = request['templates']
+                return {'status': 0, 'results': self.matcher.locate_many(frame, templates,
+                                                                          options=[options] * len(templates))}
+            finder = self._finder.KeyleFinderModule(frame, **options)
+            return {'status': 0, 'results': finder.locate_many(request['templates'])}
+        finder = self._finder.KeyleFinderModule(frame, **options)
+        return finder.locate(request['template'], roi=request.get('roi'))
+
+    def cmd_run_workflow(self, request):
+        stop = threading.Event()
+        outcome = {}
+
+        def work():
+            try:
+                with self._screen_lock:
+                    outcome['stats'] = self._api.run_workflow(
+                        items, debug=request.get('debug', False), loop=request.get('loop', False),
+                        interval=request.get('interval', 0.5), cleanup=False, capture=self.source,
+                        region_grab=request.get('region_grab', False), stop=stop)
+            except Exception as exc:
+                outcome['error'] = exc
+            finally:
+                with self._run_lock:
+                    self._run = None
+
+        with self._run_lock:
+            if self._closing:
+                return {'status': -1, 'error': 'daemon is shutting down'}
+            if self._run is not None:
+                return {'status': -1, 'error': 'busy: a workflow is running'}
+            items = self._workflow(request['config'])
+            worker = threading.Thread(target=work, name='autoclick-workflow', daemon=True)
+            self._run = (worker, stop)
+            worker.start()
+        worker.join()
+        if 'error' in outcome:
+            raise outcome['error']
+        return {'status': 0, 'cancelled': stop.is_set(), 'stats': outcome['stats'].summary()}
+
+    def _stop_workflow(self, join=False):
+        with self._run_lock:
+            run = self._run
+        if run is None:
+            return False
+        run[1].set()
+        if join:
+            run[0].join()
+        return True
+
+    def cmd_cancel(self, request):
+        return {'status': 0, 'cancelled': self._stop_workflow()}
+
+    def cmd_status(self, request):
+        with self._requests_lock:
+            requests = self.requests
+        with self._workflows_lock:
+            workflows = sorted(self._workflows)
+        with self._run_lock:
+            running = self._run is not None
+        return {
+            'status': 0,
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started,
+            'requests': requests,
+            'templates': len(self._finder.template_registry),
+            'workflows': workflows,
+            'running': running,
+            'capture': self.source.name,
+            'workers': self.matcher.workers if self.matcher is not None else 0,
+        }
+
+    def cmd_shutdown(self, request):
+        with self._run_lock:
+            self._closing = True
+        self._stop_workflow()
+        threading.Thread(target=self._server.shutdown, daemon=True).start()
+        return {'status': 0}
+
+    def serve_forever(self):
+        """Serve until ``shutdown``; refuses to start when another daemon owns the socket."""
+        if os.path.exists(self.socket_path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.socket_path)
+                except OSError:
+                    os.unlink(self.socket_path)  # stale socket of a dead daemon
+                else:
+                    raise RuntimeError(f'another daemon is already listening on {self.socket_path}')
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, _Handler)
+        self._server.daemon_threads = True
+        self._server.autoclick = self
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            with self._run_lock:
+                self._closing = True
+            # the workflow uses the frame source; close it only after the run ended
+            self._stop_workflow(join=True)
+            with self._workflows_lock:
+                for _, items in self._workflows.values():
+                    self._api.cleanup_items(items)
+                self._workflows.clear()
+            self.source.close()
+            if self.matcher is not None:
+                self.matcher.close()
+
+
+def request(payload, socket_path=DEFAULT_SOCKET, timeout=None):
+    """Send one request to a running daemon and return its decoded response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(payload).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AutoClick daemon and client')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket path')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='run the daemon in the foreground')
+    serve.add_argument('--capture', default='pyautogui',
+                       help="screen capture backend: pyautogui, mss[:MONITOR] or replay:PATH")
+    serve.add_argument('--workers', type=int, default=0,
+                       help='match multi-template locate requests on this many processes')
+    serve.add_argument('--disable-failsafe', action='store_true',
+                       help='disable PyAutoGUI fail-safe (use with caution)')
+    locate = sub.add_parser('locate', help='locate templates on the current screen')
+    locate.add_argument('templates', nargs='+', help='template image paths')
+    run = sub.add_parser('run', help='run a JSON workflow inside the daemon')
+    run.add_argument('config', help='JSON workflow file exported from the GUI')
+    run.add_argument('--debug', action='store_true', help='show debug preview windows')
+    run.add_argument('--loop', action='store_true', help='repeat workflow until interrupted')
+    run.add_argument('--interval', type=float, default=0.5, help='delay between loops in seconds')
+    run.add_argument('--region-grab', action='store_true',
+                     help='capture only the area around the last hit before grabbing the whole screen')
+    sub.add_parser('status', help='show daemon status')
+    sub.add_parser('cancel', help='stop the workflow the daemon is running')
+    sub.add_parser('stop', help='shut the daemon down')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        daemon = AutoClickDaemon(args.socket, capture=args.capture, workers=args.workers)
+        if args.disable_failsafe:
+            import pyautogui
+            pyautogui.FAILSAFE = False
+        daemon.serve_forever()
+        return
+    if args.command == 'locate':
+        templates = [os.path.abspath(t) for t in args.templates]
+        if len(templates) == 1:
+            payload = {'cmd': 'locate', 'template': templates[0]}
+        else:
+            payload = {'cmd': 'locate', 'templates': templates}
+    elif args.command == 'run':
+        payload = {'cmd': 'run_workflow', 'config': os.path.abspath(args.config), 'debug': args.debug,
+                   'loop': args.loop, 'interval': args.interval, 'region_grab': args.region_grab}
+    elif args.command == 'status':
+        payload = {'cmd': 'status'}
+    elif args.command == 'cancel':
+        payload = {'cmd': 'cancel'}
+    else:
+        payload = {'cmd': 'shutdown'}
+    response = request(payload, args.socket)
+    print(json.dumps(response, ensure_ascii=False, indent=2))
+    sys.exit(0 if response.get('status') == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
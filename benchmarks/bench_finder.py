@@ -0,0 +1,306 @@
+"""Benchmark KeyleFinderModule engines on synthetic desktops.
+
+Templates are pasted into generated screens with known transforms (scale,
+rotation, noise, JPEG artefacts) and every engine is timed on every case::
+
+    python benchmarks/bench_finder.py
+    python benchmarks/bench_finder.py --resolutions 4k --engines pyramid orb --json bench.json
+
+The table reports latency percentiles, throughput and hit accuracy; ``--json``
+writes the same numbers in machine-readable form for regression tracking.
+New engines are added by registering a function in ``ENGINES``.
+
+``--crossover`` instead times brute-force against FLANN/LSH descriptor
+matching for growing numbers of frame keypoints and templates per frame,
+which shows where ``FLANN_MIN_DESCRIPTORS`` should sit on a given machine.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+import KeyleFinderModule as finder_module
+from KeyleFinderModule import DPI_SCALES, FrameIndex, KeyleFinderModule
+
+RESOLUTIONS = {
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4k': (3840, 2160),
+}
+
+TRANSFORMS = {
+    'identity': {},
+    'scale': {'scale': 1.25},
+    'rotate': {'angle': 8.0},
+    'noise': {'noise': 6.0},
+    'jpeg': {'jpeg': 60},
+}
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo')
+DEFAULT_TEMPLATES = [os.path.join(DEMO_DIR, 'small.png')]
+
+
+def _rect(match):
+    if match is None:
+        return None
+    return match[0][0], match[0][1], match[1][0], match[1][1]
+
+
+def _template_rect(hit):
+    return None if hit is None else _rect(hit[1])
+
+
+def _engine_orb(frame, template):
+    return _rect(KeyleFinderModule(frame, matcher='bf')._match_feature(template))
+
+
+def _engine_orb_flann(frame, template):
+    return _rect(KeyleFinderModule(frame, matcher='flann')._match_feature(template))
+
+
+def _engine_template(frame, template):
+    return _template_rect(KeyleFinderModule(frame, pyramid_levels=0, scales=(1.0,))._match_template(template))
+
+
+def _engine_pyramid(frame, template):
+    return _template_rect(KeyleFinderModule(frame, scales=(1.0,))._match_template(template))
+
+
+def _engine_multiscale(frame, template):
+    return _template_rect(KeyleFinderModule(frame, scales=DPI_SCALES)._match_template(template))
+
+
+def _engine_locate(frame, template):
+    result = KeyleFinderModule(frame).locate(template)
+    if result['status'] != 0:
+        return None
+    return tuple(result['top_left'] + result['bottom_right'])
+
+
+# name -> callable(frame_index, template) returning an (x1, y1, x2, y2) hit or None
+ENGINES = {
+    'orb': _engine_orb,
+    'orb-flann': _engine_orb_flann,
+    'template': _engine_template,
+    'pyramid': _engine_pyramid,
+    'multiscale': _engine_multiscale,
+    'locate': _engine_locate,
+}
+
+
+def synthetic_desktop(width, height, rng):
+    """Draw a desktop-like BGR image: gradient, windows, title bars and text."""
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    desktop = np.empty((height, width, 3), np.uint8)
+    desktop[..., 0] = (90 + 80 * ys + 0 * xs).astype(np.uint8)
+    desktop[..., 1] = (60 + 60 * xs + 0 * ys).astype(np.uint8)
+    desktop[..., 2] = (40 + 40 * (xs + ys) / 2).astype(np.uint8)
+    for _ in range(max(4, width * height // 250000)):
+        w = int(rng.integers(width // 8, width // 2))
+        h = int(rng.integers(height // 8, height // 2))
+        x = int(rng.integers(0, width - w))
+        y = int(rng.integers(0, height - h))
+        color = tuple(int(c) for c in rng.integers(180, 256, 3))
+        cv2.rectangle(desktop, (x, y), (x + w, y + h), color, -1)
+        cv2.rectangle(desktop, (x, y), (x + w, y + 28), (120, 90, 60), -1)
+        for line in range(y + 50, y + h - 10, 22):
+            text = ''.join(chr(int(c)) for c in rng.integers(97, 123, int(rng.integers(8, 40))))
+            cv2.putText(desktop, text, (x + 10, line), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (40, 40, 40), 1, cv2.LINE_AA)
+    return desktop
+
+
+def transform_template(template, scale=1.0, angle=0.0):
+    """Scale/rotate ``template`` and return it with its paste mask."""
+    if scale == 1.0 and angle == 0.0:
+        return template, None
+    h, w = template.shape[:2]
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, scale)
+    cos, sin = abs(M[0, 0]), abs(M[0, 1])
+    nw, nh = int(h * sin + w * cos), int(h * cos + w * sin)
+    M[0, 2] += nw / 2 - w / 2
+    M[1, 2] += nh / 2 - h / 2
+    warped = cv2.warpAffine(template, M, (nw, nh))
+    mask = cv2.warpAffine(np.full((h, w), 255, np.uint8), M, (nw, nh))
+    return warped, mask
+
+
+def make_case(resolution, template, rng, scale=1.0, angle=0.0, noise=0.0, jpeg=None):
+    """Return ``(screen, truth_rect)`` with ``template`` pasted at a random spot."""
+    width, height = RESOLUTIONS[resolution] if isinstance(resolution, str) else resolution
+    screen = synthetic_desktop(width, height, rng)
+    patch, mask = transform_template(template, scale, angle)
+    ph, pw = patch.shape[:2]
+    x = int(rng.integers(0, width - pw))
+    y = int(rng.integers(0, height - ph))
+    region = screen[y:y + ph, x:x + pw]
+    if mask is None:
+        region[:] = patch
+    else:
+        region[mask > 0] = patch[mask > 0]
+    if noise:
+        screen = cv2.add(screen.astype(np.int16), rng.normal(0, noise, screen.shape).astype(np.int16))
+        screen = np.clip(screen, 0, 255).astype(np.uint8)
+    if jpeg:
+        _, buf = cv2.imencode('.jpg', screen, [cv2.IMWRITE_JPEG_QUALITY, int(jpeg)])
+        screen = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    return screen, (x, y, x + pw, y + ph)
+
+
+def is_hit(rect, truth):
+    """A hit's centre must lie within a quarter of the template size of the truth."""
+    if rect is None:
+        return False
+    tol = max(8.0, 0.25 * min(truth[2] - truth[0], truth[3] - truth[1]))
+    cx, cy = (rect[0] + rect[2]) / 2, (rect[1] + rect[3]) / 2
+    tx, ty = (truth[0] + truth[2]) / 2, (truth[1] + truth[3]) / 2
+    return abs(cx - tx) <= tol and abs(cy - ty) <= tol
+
+
+def run_benchmark(resolutions, engines, transforms, templates=None, trials=3, seed=0):
+    """Time every engine on every case and return a list of result rows."""
+    rng = np.random.default_rng(seed)
+    templates = [cv2.imread(t) if isinstance(t, str) else t for t in (templates or DEFAULT_TEMPLATES)]
+    rows = []
+    for resolution in resolutions:
+        for transform in transforms:
+            cases = [make_case(resolution, tpl, rng, **TRANSFORMS[transform])
+                     for tpl in templates for _ in range(trials)]
+            tpls = [tpl for tpl in templates for _ in range(trials)]
+            for engine in engines:
+                fn = ENGINES[engine]
+                fn(FrameIndex(cases[0][0]), tpls[0])  # warm the template registry
+                latencies, hits = [], 0
+                for (screen, truth), tpl in zip(cases, tpls):
+                    frame = FrameIndex(screen)
+                    start = time.perf_counter()
+                    rect = fn(frame, tpl)
+                    latencies.append(time.perf_counter() - start)
+                    hits += is_hit(rect, truth)
+                ms = np.array(latencies) * 1000.0
+                rows.append({
+                    'engine': engine,
+                    'resolution': resolution if isinstance(resolution, str) else '%dx%d' % tuple(resolution),
+                    'transform': transform,
+                    'samples': len(ms),
+                    'p50_ms': float(np.percentile(ms, 50)),
+                    'p90_ms': float(np.percentile(ms, 90)),
+                    'p99_ms': float(np.percentile(ms, 99)),
+                    'mean_ms': float(ms.mean()),
+                    'throughput': float(len(ms) / (ms.sum() / 1000.0)) if ms.sum() else 0.0,
+                    'accuracy': hits / len(ms),
+                })
+    return rows
+
+
+CROSSOVER_FEATURES = (500, 2000, 5000, 10000, 20000, 50000)
+CROSSOVER_TEMPLATES = (1, 5, 20)
+
+
+def run_crossover(resolution='4k', feature_counts=CROSSOVER_FEATURES, template_counts=CROSSOVER_TEMPLATES,
+                  templates=None, trials=3, seed=0):
+    """Time brute-force and FLANN/LSH ``knnMatch`` against one frame.
+
+    The FLANN time includes building the index, which happens once per
+    frame and is shared by all templates matched against it.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = RESOLUTIONS[resolution] if isinstance(resolution, str) else resolution
+    gray = cv2.cvtColor(synthetic_desktop(width, height, rng), cv2.COLOR_BGR2GRAY)
+    template_descriptors = []
+    for t in templates or DEFAULT_TEMPLATES:
+        image = cv2.imread(t) if isinstance(t, str) else t
+        template_descriptors.append(finder_module.TemplateEntry(image).descriptors)
+    rows = []
+    for count in feature_counts:
+        orb = cv2.ORB_create(nfeatures=count, fastThreshold=5)
+        _, frame_descriptors = orb.detectAndCompute(gray, None)
+        for n_templates in template_counts:
+            queries = [template_descriptors[i % len(template_descriptors)] for i in range(n_templates)]
+            timings = {'bf': [], 'flann': []}
+            for _ in range(trials):
+                start = time.perf_counter()
+                for des in queries:
+                    finder_module.knn_bruteforce(des, frame_descriptors)
+                timings['bf'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                index = finder_module.build_lsh_index(frame_descriptors)
+                for des in queries:
+                    finder_module.knn_lsh(index, des)
+                timings['flann'].append(time.perf_counter() - start)
+            bf_ms = float(np.median(timings['bf']) * 1000.0)
+            flann_ms = float(np.median(timings['flann']) * 1000.0)
+            rows.append({
+                'resolution': resolution if isinstance(resolution, str) else '%dx%d' % tuple(resolution),
+                'frame_descriptors': len(frame_descriptors),
+                'templates': n_templates,
+                'bf_ms': bf_ms,
+                'flann_ms': flann_ms,
+                'winner': 'flann' if flann_ms < bf_ms else 'bf',
+            })
+    return rows
+
+
+def format_crossover(rows):
+    header = f"{'descriptors':>12}{'templates':>10}{'bf ms':>10}{'flann ms':>10}  winner"
+    lines = [header, '-' * len(header)]
+    for r in rows:
+        lines.append(f"{r['frame_descriptors']:>12}{r['templates']:>10}{r['bf_ms']:>10.2f}{r['flann_ms']:>10.2f}"
+                     f"  {r['winner']}")
+    return '\n'.join(lines)
+
+
+def format_table(rows):
+    header = f"{'engine':<12}{'res':<8}{'transform':<10}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'ops/s':>9}{'acc':>7}"
+    lines = [header, '-' * len(header)]
+    for r in rows:
+        lines.append(f"{r['engine']:<12}{r['resolution']:<8}{r['transform']:<10}{r['p50_ms']:>9.1f}"
+                     f"{r['p90_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['throughput']:>9.1f}{r['accuracy']:>7.2f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark KeyleFinderModule engines')
+    parser.add_argument('--resolutions', nargs='+', default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument('--engines', nargs='+', default=['orb', 'pyramid', 'locate'], choices=list(ENGINES))
+    parser.add_argument('--transforms', nargs='+', default=list(TRANSFORMS), choices=list(TRANSFORMS))
+    parser.add_argument('--templates', nargs='+', default=DEFAULT_TEMPLATES, help='template image paths')
+    parser.add_argument('--trials', type=int, default=3, help='cases per template and transform')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this JSON file')
+    parser.add_argument('--crossover', action='store_true',
+                        help='time brute-force against FLANN descriptor matching instead of the engines')
+    args = parser.parse_args()
+
+    if args.crossover:
+        rows = run_crossover(args.resolutions[-1], templates=args.templates, trials=args.trials, seed=args.seed)
+        print(format_crossover(rows))
+    else:
+        rows = run_benchmark(args.resolutions, args.engines, args.transforms, args.templates, args.trials,
+                             args.seed)
+        print(format_table(rows))
+    if args.json:
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'opencv': cv2.__version__,
+                'machine': platform.machine(),
+                'trials': args.trials,
+                'seed': args.seed,
+                'templates': [os.path.basename(t) for t in args.templates],
+            },
+            'results': rows,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,89 @@
 import argparse
 import pyautogui
-from autoclick_api import load_items, run_workflow
+import KeyleFinderModule as finder_module
+from async_workflow import run_concurrent
+from autoclick_api import MatchStats, cleanup_items, load_items, run_workflow
+from tracing import tracer
 
 
 def main():
     parser = argparse.ArgumentParser(description='Run AutoClick workflow from a JSON file')
-    parser.add_argument('config', help='JSON workflow file exported from the GUI')
+    parser.add_argument('config', help='JSON workflow or .acwf pack exported from the GUI')
     parser.add_argument('--debug', action='store_true', help='show debug preview windows')
     parser.add_argument('--loop', action='store_true', help='repeat workflow until interrupted')
     parser.add_argument('--interval', type=float, default=0.5, help='delay between loops in seconds')
+    parser.add_argument('--capture', default='pyautogui',
+                        help="screen capture backend: pyautogui, mss[:MONITOR] or replay:PATH")
+    parser.add_argument('--region-grab', action='store_true',
+                        help='capture only the area around the last hit before grabbing the whole screen')
+    parser.add_argument('--background-capture', action='store_true',
+                        help='capture frames in a background thread while matching')
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help="reuse an item's previous result when the screen has not changed")
+    parser.add_argument('--trace', metavar='FILE',
+                        help='record per-phase timings, write a Chrome trace to FILE and print a summary')
+    parser.add_argument('--stats', action='store_true',
+                        help='print per-item match scores, engines and timings when the run ends')
+    parser.add_argument('--scales', metavar='LIST',
+                        help="comma-separated template scales to sweep when the first scale misses, "
+                             "e.g. 1,1.25,1.5,2, or 'dpi' for %s (default: only the item's last or "
+                             "DPI-derived scale and 1.0)" % ','.join(str(s) for s in finder_module.DPI_SCALES))
+    parser.add_argument('--color-mode', choices=finder_module.COLOR_MODES,
+                        help='default colour mode for template matching (items may override it)')
+    parser.add_argument('--downsample', type=int,
+                        help='default downsample factor for template matching, e.g. 2 for half resolution')
+    parser.add_argument('--matcher', choices=finder_module.FEATURE_MATCHERS,
+                        help='descriptor matcher for feature matching (default: auto)')
+    parser.add_argument('--orb-profile', choices=list(finder_module.ORB_PROFILES),
+                        help='default ORB detector profile (items may override it)')
+    parser.add_argument('--watch', metavar='CONFIG', action='append', default=[],
+                        help='also run CONFIG as a looping watcher alongside the main workflow (repeatable)')
     parser.add_argument('--disable-failsafe', action='store_true',
                         help='disable PyAutoGUI fail-safe (use with caution)')
     args = parser.parse_args()
 
+    if args.watch:
+        # the concurrent engine shares one capture stream and matches on a thread pool
+        unsupported = [flag for flag, on in (('--debug', args.debug), ('--region-grab', args.region_grab),
+                                             ('--background-capture', args.background_capture)) if on]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be combined with --watch")
+
     if args.disable_failsafe:
         pyautogui.FAILSAFE = False
 
+    tracer.enabled = bool(args.trace)
+    if args.scales:
+        finder_module.TEMPLATE_SCALES = (finder_module.DPI_SCALES if args.scales == 'dpi'
+                                         else tuple(float(s) for s in args.scales.split(',')))
+    if args.matcher:
+        finder_module.FEATURE_MATCHER = args.matcher
+    if args.orb_profile:
+        finder_module.ORB_PROFILE = args.orb_profile
+    if args.color_mode:
+        finder_module.TEMPLATE_COLOR_MODE = args.color_mode
+    if args.downsample:
+        finder_module.TEMPLATE_DOWNSAMPLE = args.downsample
+    stats = MatchStats() if args.stats else None
     items = load_items(args.config)
-    run_workflow(items, debug=args.debug, loop=args.loop, interval=args.interval)
+    groups = [{'name': 'main', 'items': items, 'loop': args.loop, 'interval': args.interval}]
+    try:
+        if args.watch:
+            for path in args.watch:
+                groups.append({'name': path, 'items': load_items(path), 'loop': True, 'interval': args.interval})
+            run_concurrent(groups, capture=args.capture, skip_unchanged=args.skip_unchanged, stats=stats)
+            return
+        run_workflow(items, debug=args.debug, loop=args.loop, interval=args.interval, cleanup=False,
+                     capture=args.capture, region_grab=args.region_grab,
+                     background_capture=args.background_capture, skip_unchanged=args.skip_unchanged, stats=stats)
+    finally:
+        for group in groups:
+            cleanup_items(group['items'])
+        if stats is not None:
+            print(stats.format_summary())
+        if args.trace:
+            tracer.export_chrome(args.trace)
+            print(tracer.format_summary())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,381 @@
+"""Screen capture backends behind a common :class:`FrameSource` interface.
+
+``pyautogui``
+    The portable default; slow on Linux because every grab goes through PIL.
+``mss``
+    Uses the ``mss`` package (XShm shared memory on X11, native APIs on
+    Windows and macOS).  Install it with ``pip install mss``.
+``replay:PATH``
+    Replays an image file or a directory of images, mainly for tests.
+
+Every backend returns BGR ``ndarray`` frames and supports grabbing a region
+given in screen coordinates.  :meth:`FrameSource.monitor_frames` splits the
+screen into one frame per monitor, so a multi-monitor desktop is matched
+monitor by monitor instead of as one huge image with unused gaps.
+"""
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from KeyleFinderModule import FrameIndex, to_bgr
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+# CaptureThread: default pause between grabs, and the range of the pause
+# after a failed grab in seconds (it doubles after every failure)
+CAPTURE_INTERVAL = 0.015
+CAPTURE_RETRY_MIN = 0.05
+CAPTURE_RETRY_MAX = 1.0
+
+
+class FrameSource:
+    """Produce BGR screen frames, optionally restricted to a region."""
+
+    name = ''
+
+    def bounds(self):
+        """Return the ``(x1, y1, x2, y2)`` screen rectangle this source covers."""
+        raise NotImplementedError
+
+    def grab(self, region=None):
+        """Return a BGR ``ndarray`` of ``region`` (clipped) or of the whole source."""
+        raise NotImplementedError
+
+    def monitors(self):
+        """Return the ``(x1, y1, x2, y2)`` screen rectangle of every monitor."""
+        return [self.bounds()]
+
+    def dpi_scale(self):
+        """Return frame pixels per logical screen pixel, e.g. 2.0 on a Retina display."""
+        return 1.0
+
+    def clip(self, region):
+        bx1, by1, bx2, by2 = self.bounds()
+        x1, y1, x2, y2 = (int(v) for v in region)
+        return max(bx1, x1), max(by1, y1), min(bx2, x2), min(by2, y2)
+
+    def frame(self, region=None):
+        """Grab a :class:`FrameIndex` whose origin is its position on screen."""
+        if region is None:
+            return FrameIndex(self.grab(), self.bounds()[:2])
+        region = self.clip(region)
+        return FrameIndex(self.grab(region), region[:2])
+
+    def monitor_frames(self, monitor=None):
+        """Return one :class:`FrameIndex` per monitor, or only monitor ``monitor`` (1-based).
+
+        The default grabs the whole source once and crops it, so all
+        monitors come from the same instant.
+        """
+        frame = self.frame()
+        rects = self._select_monitors(monitor)
+        if len(rects) == 1 and rects[0] == self.bounds():
+            return [frame]
+        ox, oy = frame.origin
+        return [frame.crop(x1 - ox, y1 - oy, x2 - ox, y2 - oy) for x1, y1, x2, y2 in rects]
+
+    def _select_monitors(self, monitor):
+        rects = self.monitors()
+        if not monitor:
+            return rects
+        if not 1 <= monitor <= len(rects):
+            raise ValueError(f'Monitor {monitor} does not exist, found {len(rects)}')
+        return [rects[monitor - 1]]
+
+    def invalidate(self):
+        """Note that the screen is about to change, e.g. after a click.
+
+        Buffered sources use it to avoid handing out frames captured earlier.
+        """
+
+    def close_thread(self):
+        """Release resources bound to the calling thread, e.g. before it exits."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PyAutoGUISource(FrameSource):
+    """Capture through ``pyautogui.screenshot``.
+
+    Frames are in screenshot pixels, which on HiDPI/Retina screens differ
+    from the logical pixels of ``pyautogui.size()``.  There, region grabs
+    crop a full screenshot because ``screenshot(region=...)`` would take
+    logical coordinates.
+    """
+
+    name = 'pyautogui'
+
+    def __init__(self):
+        import pyautogui
+        self._pyautogui = pyautogui
+        self._size = None  # screenshot (width, height)
+        self._hidpi = False
+
+    def _screenshot(self):
+        image = to_bgr(self._pyautogui.screenshot())
+        h, w = image.shape[:2]
+        self._size = w, h
+        self._hidpi = tuple(self._pyautogui.size()) != (w, h)
+        return image
+
+    def bounds(self):
+        if self._size is None:
+            self._screenshot()
+        return (0, 0) + self._size
+
+    def dpi_scale(self):
+        return self.bounds()[2] / self._pyautogui.size()[0]
+
+    def grab(self, region=None):
+        if region is None:
+            return self._screenshot()
+        x1, y1, x2, y2 = self.clip(region)
+        if self._hidpi:
+            return self._screenshot()[y1:y2, x1:x2]
+        return to_bgr(self._pyautogui.screenshot(region=(x1, y1, x2 - x1, y2 - y1)))
+
+
+class MSSSource(FrameSource):
+    """Capture through ``mss`` (XShm shared memory on X11).
+
+    ``monitor`` follows the mss numbering: 0 is the virtual desktop spanning
+    every monitor, 1..n are the individual monitors.
+    """
+
+    name = 'mss'
+
+    def __init__(self, monitor=0):
+        try:
+            import mss
+        except ImportError as exc:
+            raise ImportError("The 'mss' capture backend requires mss. Install it with 'pip install mss'.") from exc
+        self._mss = mss
+        # mss handles are bound to the thread that created them
+        self._local = threading.local()
+        self.monitor = monitor
+
+    @property
+    def _sct(self):
+        sct = getattr(self._local, 'sct', None)
+        if sct is None:
+            sct = self._local.sct = self._mss.mss()
+        return sct
+
+    def bounds(self):
+        mon = self._sct.monitors[self.monitor]
+        return mon['left'], mon['top'], mon['left'] + mon['width'], mon['top'] + mon['height']
+
+    def monitors(self):
+        if self.monitor != 0:
+            return [self.bounds()]
+        return [(m['left'], m['top'], m['left'] + m['width'], m['top'] + m['height'])
+                for m in self._sct.monitors[1:]] or [self.bounds()]
+
+    def monitor_frames(self, monitor=None):
+        # grab each monitor on its own so the gaps of the virtual desktop are never copied
+        return [self.frame(rect) for rect in self._select_monitors(monitor)]
+
+    def grab(self, region=None):
+        x1, y1, x2, y2 = self.bounds() if region is None else self.clip(region)
+        shot = self._sct.grab({'left': x1, 'top': y1, 'width': x2 - x1, 'height': y2 - y1})
+        return cv2.cvtColor(np.asarray(shot), cv2.COLOR_BGRA2BGR)
+
+    def close_thread(self):
+        sct = getattr(self._local, 'sct', None)
+        if sct is not None:
+            sct.close()
+            self._local.sct = None
+
+    def close(self):
+        self.close_thread()
+
+
+class ReplaySource(FrameSource):
+    """Replay an image file, or the images of a directory in name order.
+
+    Each full :meth:`grab` advances to the next image; with ``loop`` the
+    sequence restarts, otherwise the last image repeats.  Region grabs crop
+    the current image.  ``monitors`` optionally lists monitor rectangles to
+    simulate a multi-monitor layout.
+    """
+
+    name = 'replay'
+
+    def __init__(self, path, loop=True, monitors=None):
+        if os.path.isdir(path):
+            self.paths = [os.path.join(path, f) for f in sorted(os.listdir(path))
+                          if f.lower().endswith(IMAGE_EXTENSIONS)]
+        else:
+            self.paths = [path]
+        if not self.paths:
+            raise ValueError(f'No images to replay in {path}')
+        self.loop = loop
+        self._monitors = [tuple(m) for m in monitors] if monitors else None
+        self._index = -1
+        self._current = None
+
+    def _advance(self):
+        if self._index + 1 < len(self.paths):
+            self._index += 1
+        elif self.loop:
+            self._index = 0
+        elif self._current is not None:
+            return self._current
+        self._current = cv2.imread(self.paths[self._index])
+        if self._current is None:
+            raise ValueError(f'Cannot read {self.paths[self._index]}')
+        return self._current
+
+    def bounds(self):
+        image = self._current if self._current is not None else self._advance()
+        h, w = image.shape[:2]
+        return 0, 0, w, h
+
+    def monitors(self):
+        return list(self._monitors) if self._monitors else [self.bounds()]
+
+    def grab(self, region=None):
+        if region is None:
+            return self._advance()
+        if self._current is None:
+            self._advance()
+        x1, y1, x2, y2 = self.clip(region)
+        return self._current[y1:y2, x1:x2]
+
+
+class CaptureThread(FrameSource):
+    """Grab frames from ``source`` continuously in a background thread.
+
+    Frames are copied into a ring of ``slots`` preallocated arrays and
+    :meth:`grab` returns the newest one without waiting for a capture, so
+    capturing overlaps with matching and memory stays bounded.  The array
+    returned by :meth:`grab` stays valid until the next :meth:`grab` call;
+    only one consumer thread is supported.  A failed capture is reported
+    and retried with a growing pause; :meth:`grab` raises only when no
+    fresh frame arrives in time.
+    """
+
+    def __init__(self, source, slots=3, interval=CAPTURE_INTERVAL):
+        if slots < 3:
+            raise ValueError('CaptureThread needs at least 3 slots')
+        self.source = source
+        self.name = source.name
+        self.interval = interval
+        self._slots = [None] * slots
+        self._stamps = [0.0] * slots  # monotonic time each slot's capture started
+        self._latest = -1
+        self._held = -1
+        self._fresh_after = 0.0
+        self._error = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='autoclick-capture', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        retry = CAPTURE_RETRY_MIN
+        try:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                try:
+                    image = self.source.grab()
+                except Exception as exc:
+                    with self._cond:
+                        if self._error is None:
+                            print(f'Warning: background capture failed, retrying: {exc}', file=sys.stderr)
+                        self._error = exc
+                    self._stop.wait(retry)
+                    retry = min(CAPTURE_RETRY_MAX, retry * 2)
+                    continue
+                retry = CAPTURE_RETRY_MIN
+                with self._cond:
+                    slot = next(i for i in range(len(self._slots)) if i not in (self._latest, self._held))
+                buf = self._slots[slot]
+                if buf is None or buf.shape != image.shape:
+                    buf = self._slots[slot] = np.empty_like(image)
+                np.copyto(buf, image)
+                with self._cond:
+                    self._stamps[slot] = started
+                    self._latest = slot
+                    self._error = None
+                    self._cond.notify_all()
+                if self.interval:
+                    self._stop.wait(self.interval)
+        finally:
+            # thread-bound handles (e.g. mss) can only be closed from here
+            self.source.close_thread()
+
+    def bounds(self):
+        return self.source.bounds()
+
+    def monitors(self):
+        return self.source.monitors()
+
+    def dpi_scale(self):
+        return self.source.dpi_scale()
+
+    def grab(self, region=None, timeout=5.0):
+        with self._cond:
+            self._held = -1
+            ready = self._cond.wait_for(
+                lambda: self._latest >= 0 and self._stamps[self._latest] >= self._fresh_after,
+                timeout,
+            )
+            if not ready:
+                if self._error is not None:
+                    raise RuntimeError('Background capture failed') from self._error
+                raise TimeoutError(f'No frame captured within {timeout} seconds')
+            self._held = self._latest
+            image = self._slots[self._held]
+        if region is None:
+            return image
+        bx1, by1 = self.bounds()[:2]
+        x1, y1, x2, y2 = self.clip(region)
+        return image[y1 - by1:y2 - by1, x1 - bx1:x2 - bx1]
+
+    def invalidate(self):
+        with self._cond:
+            self._fresh_after = time.monotonic()
+
+    def stop(self):
+        """Stop the capture thread without closing the wrapped source."""
+        self._stop.set()
+        self._thread.join()
+
+    def close(self):
+        self.stop()
+        self.source.close()
+
+
+FRAME_SOURCES = {
+    'pyautogui': PyAutoGUISource,
+    'mss': MSSSource,
+    'replay': ReplaySource,
+}
+
+
+def create_frame_source(spec=None):
+    """Build a :class:`FrameSource` from a name such as ``'mss'`` or ``'replay:DIR'``.
+
+    ``None`` selects ``pyautogui``; an existing :class:`FrameSource` is returned as is.
+    """
+    if isinstance(spec, FrameSource):
+        return spec
+    name, _, arg = (spec or 'pyautogui').partition(':')
+    if name not in FRAME_SOURCES:
+        raise ValueError(f"Unknown capture backend {name!r}, choose from {', '.join(FRAME_SOURCES)}")
+    if name == 'replay':
+        return ReplaySource(arg)
+    if arg:
+        return FRAME_SOURCES[name](int(arg))
+    return FRAME_SOURCES[name]()
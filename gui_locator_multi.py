@@ -6,7 +6,9 @@ import os
 import json
 import base64
 import pyautogui
+import queue
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import keyboard as _keyboard
@@ -51,7 +53,12 @@ else:
     keyboard = _keyboard
 import time
 
-from KeyleFinderModule import KeyleFinderModule
+import KeyleFinderModule as finder_module
+from KeyleFinderModule import COLOR_MODES, ORB_PROFILES
+from autoclick_api import WAIT_POLL_MAX, WAIT_POLL_MIN, WAIT_TIMEOUT, locate_item, prepare_items
+from frame_source import FRAME_SOURCES, create_frame_source
+from tracing import tracer
+from workflow_pack import WorkflowPack, is_pack, write_pack
 
 if sys.platform == 'darwin':
     from pynput.mouse import Controller as _Mouse
@@ -134,7 +141,7 @@ class ScreenCropper(tk.Toplevel):
             return
         cropped = self.screenshot.crop((img_x1, img_y1, img_x2, img_y2))
         self.destroy()
-        self.callback(cropped)
+        self.callback(cropped, self.scale_x)
 
 
 class App(tk.Tk):
@@ -164,12 +171,23 @@ class App(tk.Tk):
         self.hide_window_var = tk.BooleanVar(value=True)
         self.hotkey_enabled_var = tk.BooleanVar(value=False)  # 默认关闭热键
         self.hotkey_var = tk.StringVar(value=HOTKEY)
+        self.capture_var = tk.StringVar(value='pyautogui')
+        self.trace_var = tk.BooleanVar(value=False)
+        self.skip_unchanged_var = tk.BooleanVar(value=False)
+        self.color_mode_var = tk.StringVar(value=finder_module.TEMPLATE_COLOR_MODE)
+        self.downsample_var = tk.StringVar(value=str(finder_module.TEMPLATE_DOWNSAMPLE))
         self.long_press_active = False
         self.long_press_pos = None
         self.after(100, self.check_long_press)
         self.running = False
         self.run_after_id = None
         self.finish_search_func = None
+        # capture and matching run on one worker thread so Tk stays responsive;
+        # results are handed back through a queue polled from the Tk loop
+        self.match_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='autoclick-match')
+        self.match_results = queue.Queue()
+        self.run_generation = 0
+        self.after(15, self.poll_match_results)
 
         top = ttk.Frame(self)
         top.pack(fill='x', pady=5)
@@ -206,7 +224,7 @@ class App(tk.Tk):
 
         self.tree = ttk.Treeview(
             self,
-            columns=('alias', 'action', 'delay', 'interrupt', 'enable'),
+            columns=('alias', 'action', 'delay', 'interrupt', 'enable', 'wait', 'color', 'down', 'orb'),
             show='tree headings',
             height=8,
         )
@@ -222,6 +240,14 @@ class App(tk.Tk):
         self.tree.column('interrupt', width=50, anchor='center')
         self.tree.heading('enable', text='启用')
         self.tree.column('enable', width=50, anchor='center')
+        self.tree.heading('wait', text='等待(ms)')
+        self.tree.column('wait', width=70, anchor='center')
+        self.tree.heading('color', text='颜色')
+        self.tree.column('color', width=50, anchor='center')
+        self.tree.heading('down', text='缩小')
+        self.tree.column('down', width=50, anchor='center')
+        self.tree.heading('orb', text='特征')
+        self.tree.column('orb', width=70, anchor='center')
         self.tree.pack(padx=10, pady=5, fill='x')
         self.tree.bind('<Double-1>', self.on_tree_double_click)
         self.tree.bind('<<TreeviewSelect>>', self.on_tree_select)
@@ -273,6 +299,29 @@ class App(tk.Tk):
             self.long_press_active = False
         self.after(100, self.check_long_press)
 
+    def submit_match(self, match, callback):
+        """Run ``match`` on the worker thread and pass its result to ``callback`` on the Tk thread."""
+        generation = self.run_generation
+        future = self.match_pool.submit(match)
+        future.add_done_callback(lambda f: self.match_results.put((generation, f, callback)))
+
+    def poll_match_results(self):
+        while True:
+            try:
+                generation, future, callback = self.match_results.get_nowait()
+            except queue.Empty:
+                break
+            # results of a stopped run are dropped
+            if generation != self.run_generation or not self.running:
+                continue
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f'Warning: match failed: {e}')
+                result = {'status': 1}
+            callback(result)
+        self.after(15, self.poll_match_results)
+
     def update_photo(self, idx):
         path = self.items[idx]['path']
         offset = self.items[idx].get('offset', [0.5, 0.5])
@@ -327,11 +376,16 @@ class App(tk.Tk):
         self.tree.set(item_id, 'delay', str(item.get('delay', 0)))
         self.tree.set(item_id, 'interrupt', '✔' if item.get('interrupt') else '')
         self.tree.set(item_id, 'enable', '✔' if item.get('enable', True) else '')
+        self.tree.set(item_id, 'wait', str(item.get('timeout', WAIT_TIMEOUT)) if item.get('wait_until_visible') else '')
+        # empty means the global setting applies
+        self.tree.set(item_id, 'color', item.get('color_mode') or '')
+        self.tree.set(item_id, 'down', f"1/{item['downsample']}" if item.get('downsample') else '')
+        self.tree.set(item_id, 'orb', item.get('orb_profile') or '')
 
     def refresh_tree(self):
         self.tree.delete(*self.tree.get_children())
         for item in self.items:
-            self.tree.insert('', 'end', text=os.path.basename(item['path']), values=('', '', '', '', ''))
+            self.tree.insert('', 'end', text=os.path.basename(item['path']), values=('', '', '', '', '', '', '', '', ''))
         for i in range(len(self.items)):
             self.refresh_tree_row(i)
 
@@ -363,6 +417,26 @@ class App(tk.Tk):
             item['interrupt'] = not item.get('interrupt', False)
         elif column == '#5':  # enable
             item['enable'] = not item.get('enable', True)
+        elif column == '#6':  # wait until visible, 0 disables
+            current = item.get('timeout', WAIT_TIMEOUT) if item.get('wait_until_visible') else 0
+            val = simpledialog.askinteger('Wait', 'Wait until visible, timeout in ms (0 = off):',
+                                          initialvalue=current, minvalue=0)
+            if val is None:
+                return
+            item['wait_until_visible'] = val > 0
+            if val > 0:
+                item['timeout'] = val
+        elif column == '#7':  # colour mode, cycling back to the global setting
+            order = [None] + list(COLOR_MODES)
+            item['color_mode'] = order[(order.index(item.get('color_mode')) + 1) % len(order)]
+        elif column == '#8':  # downsample factor
+            order = [None, 1, 2, 4]
+            current = item.get('downsample')
+            item['downsample'] = order[(order.index(current) + 1) % len(order) if current in order else 0]
+        elif column == '#9':  # ORB detector profile
+            order = [None] + list(ORB_PROFILES)
+            current = item.get('orb_profile')
+            item['orb_profile'] = order[(order.index(current) + 1) % len(order) if current in order else 0]
         self.refresh_tree_row(idx)
 
     def add_item(self):
@@ -371,7 +445,7 @@ class App(tk.Tk):
         screenshot = pyautogui.screenshot()
         ScreenCropper(self, screenshot, self.on_crop_done)
 
-    def on_crop_done(self, cropped):
+    def on_crop_done(self, cropped, scale=1.0):
         self.deiconify()
         if cropped is None:
             return
@@ -390,10 +464,11 @@ class App(tk.Tk):
             'delay': 0,
             'interrupt': False,
             'enable': True,
+            'dpi_scale': round(scale, 3),
             'offset': [0.5, 0.5]
         }
         self.items.append(item)
-        self.tree.insert('', 'end', text=os.path.basename(path), values=('', '', '', '', ''))
+        self.tree.insert('', 'end', text=os.path.basename(path), values=('', '', '', '', '', '', '', '', ''))
         idx = len(self.items) - 1
         self.refresh_tree_row(idx)
         self.current_index = idx
@@ -403,7 +478,8 @@ class App(tk.Tk):
         if not self.items:
             messagebox.showinfo('Info', 'No items to export')
             return
-        file = filedialog.asksaveasfilename(defaultextension='.json')
+        file = filedialog.asksaveasfilename(defaultextension='.json',
+                                            filetypes=[('JSON', '*.json'), ('Workflow pack', '*.acwf')])
         if not file:
             return
         data = []
@@ -417,20 +493,38 @@ class App(tk.Tk):
                 'delay': item.get('delay', 0),
                 'interrupt': item.get('interrupt', False),
                 'enable': item.get('enable', True),
+                'wait_until_visible': item.get('wait_until_visible', False),
+                'timeout': item.get('timeout', WAIT_TIMEOUT),
+                'monitor': item.get('monitor'),
+                'color_mode': item.get('color_mode'),
+                'downsample': item.get('downsample'),
+                'orb_profile': item.get('orb_profile'),
+                'match_all': item.get('match_all', False),
+                'scales': item.get('scales'),
+                'dpi_scale': item.get('dpi_scale'),
                 'offset': item.get('offset', [0.5, 0.5])
             })
-        with open(file, 'w', encoding='utf-8') as f:
-            json.dump(data, f)
+        if file.lower().endswith('.acwf'):
+            write_pack(file, data)
+        else:
+            with open(file, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
         self.log(f'Exported {len(self.items)} items to {file}')
 
     def import_items(self):
-        file = filedialog.askopenfilename(filetypes=[('JSON', '*.json')])
+        file = filedialog.askopenfilename(filetypes=[('Workflow', '*.json *.acwf'), ('JSON', '*.json'),
+                                                     ('Workflow pack', '*.acwf')])
         if not file:
             return
-        with open(file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        for entry in data:
-            img_data = base64.b64decode(entry['image'])
+        if is_pack(file):
+            with WorkflowPack(file) as pack:
+                data = pack.entries
+                images = [pack.png_bytes(i) for i in range(len(pack))]
+        else:
+            with open(file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            images = [base64.b64decode(entry['image']) for entry in data]
+        for entry, img_data in zip(data, images):
             with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
                 tmp.write(img_data)
                 path = tmp.name
@@ -441,10 +535,19 @@ class App(tk.Tk):
                 'delay': entry.get('delay', 0),
                 'interrupt': entry.get('interrupt', False),
                 'enable': entry.get('enable', True),
+                'wait_until_visible': entry.get('wait_until_visible', False),
+                'timeout': entry.get('timeout', WAIT_TIMEOUT),
+                'monitor': entry.get('monitor'),
+                'color_mode': entry.get('color_mode'),
+                'downsample': entry.get('downsample'),
+                'orb_profile': entry.get('orb_profile'),
+                'match_all': entry.get('match_all', False),
+                'scales': entry.get('scales'),
+                'dpi_scale': entry.get('dpi_scale'),
                 'offset': entry.get('offset', [0.5, 0.5])
             }
             self.items.append(item)
-            self.tree.insert('', 'end', text=os.path.basename(path), values=('', '', '', '', ''))
+            self.tree.insert('', 'end', text=os.path.basename(path), values=('', '', '', '', '', '', '', '', ''))
             idx = len(self.items) - 1
             self.refresh_tree_row(idx)
             self.current_index = idx
@@ -486,7 +589,7 @@ class App(tk.Tk):
         item = src.copy()
         item['path'] = new_path
         self.items.insert(idx + 1, item)
-        self.tree.insert('', idx + 1, text=os.path.basename(new_path), values=('', '', '', '', ''))
+        self.tree.insert('', idx + 1, text=os.path.basename(new_path), values=('', '', '', '', '', '', '', '', ''))
         self.refresh_tree_row(idx + 1)
         self.tree.selection_set(self.tree.get_children()[idx + 1])
         self.current_index = idx + 1
@@ -586,6 +689,13 @@ class App(tk.Tk):
         ttk.Checkbutton(win, text='Fail-safe', variable=self.failsafe_var).pack(anchor='w', padx=10, pady=(0, 0))
         ttk.Label(win, text='将鼠标移到屏幕角落终止').pack(anchor='w', padx=30, pady=(0, 5))
 
+        ttk.Checkbutton(win, text='Skip unchanged screens',
+                        variable=self.skip_unchanged_var).pack(anchor='w', padx=10, pady=(0, 0))
+        ttk.Label(win, text='画面未变化时复用上次匹配结果').pack(anchor='w', padx=30, pady=(0, 5))
+
+        ttk.Checkbutton(win, text='Trace timings', variable=self.trace_var).pack(anchor='w', padx=10, pady=(0, 0))
+        ttk.Label(win, text='记录各阶段耗时，结束后导出 Chrome trace').pack(anchor='w', padx=30, pady=(0, 5))
+
         ttk.Checkbutton(win, text='Hide window while searching',
                         variable=self.hide_window_var).pack(anchor='w', padx=10, pady=(0, 0))
         ttk.Label(win, text='搜索时隐藏主窗体').pack(anchor='w', padx=30, pady=(0, 5))
@@ -603,6 +713,20 @@ class App(tk.Tk):
         ttk.Combobox(win, width=4, state='readonly',
                      values=HOTKEY_OPTIONS, textvariable=self.hotkey_var).pack(anchor='w', padx=10, pady=(0, 0))
         ttk.Label(win, text='触发搜索的快捷键').pack(anchor='w', padx=30, pady=(0, 5))
+
+        ttk.Label(win, text='Capture:').pack(anchor='w', padx=10, pady=(10, 0))
+        ttk.Combobox(win, width=10, state='readonly', values=[name for name in FRAME_SOURCES if name != 'replay'],
+                     textvariable=self.capture_var).pack(anchor='w', padx=10, pady=(0, 0))
+        ttk.Label(win, text='截图后端，mss 速度更快（需 pip install mss）').pack(anchor='w', padx=30, pady=(0, 5))
+
+        ttk.Label(win, text='Match colour / downsample:').pack(anchor='w', padx=10, pady=(10, 0))
+        row = ttk.Frame(win)
+        row.pack(anchor='w', padx=10, pady=(0, 0))
+        ttk.Combobox(row, width=5, state='readonly', values=list(COLOR_MODES),
+                     textvariable=self.color_mode_var).pack(side='left')
+        ttk.Combobox(row, width=3, state='readonly', values=['1', '2', '4'],
+                     textvariable=self.downsample_var).pack(side='left', padx=(5, 0))
+        ttk.Label(win, text='模板匹配的默认颜色模式与缩小倍数，可在列表中按项目覆盖').pack(anchor='w', padx=30, pady=(0, 5))
         ttk.Button(win, text='Close', command=win.destroy).pack(pady=10)
         style = ttk.Style(win)
         style.configure('Danger.TCheckbutton', foreground='red', background=BG_COLOR)
@@ -647,6 +771,20 @@ class App(tk.Tk):
                     return
                 start_idx = self.tree.index(sel[0])
 
+        try:
+            source = create_frame_source(self.capture_var.get())
+        except ImportError as e:
+            messagebox.showerror('Error', str(e))
+            return
+
+        tracer.enabled = self.trace_var.get()
+        if tracer.enabled:
+            tracer.clear()
+        finder_module.TEMPLATE_COLOR_MODE = self.color_mode_var.get()
+        finder_module.TEMPLATE_DOWNSAMPLE = int(self.downsample_var.get())
+        # runs on the match worker ahead of the first search
+        self.match_pool.submit(prepare_items, list(self.items), source)
+
         hide_window = self.hide_window_var.get()
         if hide_window:
             self.withdraw()
@@ -657,6 +795,9 @@ class App(tk.Tk):
         self.running = True
 
         def finish_search():
+            # queued behind any match still using the source
+            self.match_pool.submit(source.close)
+            self.run_generation += 1
             if hide_window:
                 self.deiconify()
             if orig_image:
@@ -667,6 +808,11 @@ class App(tk.Tk):
             self.running = False
             self.run_after_id = None
             self.finish_search_func = None
+            if tracer.enabled:
+                trace_path = os.path.join(tempfile.gettempdir(), 'autoclick_trace.json')
+                tracer.export_chrome(trace_path)
+                print(tracer.format_summary())
+                self.log(f'Trace saved to {trace_path}')
 
         def run_items(idx=0):
             if idx >= len(self.items):
@@ -684,19 +830,51 @@ class App(tk.Tk):
                 self.after(10, lambda: run_items(idx + 1))
                 return
 
-            def execute():
+            def row_id():
+                # the list stays editable while matching runs; stop if this row went away
+                rows = self.tree.get_children()
+                if idx < len(rows) and idx < len(self.items) and self.items[idx] is item:
+                    return rows[idx]
+                self.log(f'Item {idx} was removed or moved during the run, stopping')
+                self.stop_search()
+                return None
+
+            def execute(deadline, pause=WAIT_POLL_MIN):
                 if self.long_press_active and item.get('action') != 'long':
                     pyautogui.mouseUp()
                     self.long_press_active = False
 
-                item_id = self.tree.get_children()[idx]
+                item_id = row_id()
+                if item_id is None:
+                    return
                 self.tree.item(item_id, tags=('running',))
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
-                    screenshot = pyautogui.screenshot()
-                    screenshot.save(tmp.name)
-                    finder = KeyleFinderModule(tmp.name)
-                    result = finder.locate(item['path'], debug=self.debug_var.get())
-                os.unlink(tmp.name)
+                # while waiting, only the last attempt shows the debug preview
+                last_try = deadline is None or time.monotonic() >= deadline
+                debug = self.debug_var.get() and last_try
+                skip_unchanged = self.skip_unchanged_var.get()
+
+                def match():
+                    with tracer.span('step', index=idx, alias=item.get('alias', '')):
+                        return locate_item(source, item, debug=debug, skip_unchanged=skip_unchanged)
+
+                if debug:
+                    # OpenCV preview windows must be opened from the main thread
+                    handle_result(match(), deadline, pause)
+                else:
+                    self.submit_match(match, lambda result: handle_result(result, deadline, pause))
+
+            def handle_result(result, deadline, pause):
+                item_id = row_id()
+                if item_id is None:
+                    return
+                if result.get('status') != 0 and item.get('wait_until_visible'):
+                    # keep re-matching with a growing pause until the timeout
+                    now = time.monotonic()
+                    if now < deadline:
+                        wait_ms = int(min(pause, deadline - now) * 1000)
+                        self.run_after_id = self.after(
+                            wait_ms, lambda: execute(deadline, min(WAIT_POLL_MAX, pause * 2)))
+                        return
 
                 next_idx = idx + 1
                 if result.get('status') == 0:
@@ -707,15 +885,16 @@ class App(tk.Tk):
                     offset = item.get('offset', [0.5, 0.5])
                     click_x = tl[0] + int(width * offset[0])
                     click_y = tl[1] + int(height * offset[1])
-                    move_mouse(click_x, click_y)
-                    if item.get('action') == 'double':
-                        pyautogui.click(clicks=2)
-                    elif item.get('action') == 'long':
-                        pyautogui.mouseDown()
-                        self.long_press_active = True
-                        self.long_press_pos = (click_x, click_y)
-                    else:
-                        pyautogui.click()
+                    with tracer.span('click'):
+                        move_mouse(click_x, click_y)
+                        if item.get('action') == 'double':
+                            pyautogui.click(clicks=2)
+                        elif item.get('action') == 'long':
+                            pyautogui.mouseDown()
+                            self.long_press_active = True
+                            self.long_press_pos = (click_x, click_y)
+                        else:
+                            pyautogui.click()
                     tags = list(self.tree.item(item_id, 'tags'))
                     if 'running' in tags:
                         tags.remove('running')
@@ -731,9 +910,14 @@ class App(tk.Tk):
                         next_idx = 0
 
                 delay = item.get('delay', 0)
+                if item.get('wait_until_visible'):
+                    # time spent waiting for the item counts toward its delay
+                    delay = max(0, delay - int((time.monotonic() - started) * 1000))
                 self.run_after_id = self.after(delay, lambda: run_items(next_idx))
 
-            execute()
+            started = time.monotonic()
+            # the wait timeout runs from the first attempt
+            execute(started + item.get('timeout', WAIT_TIMEOUT) / 1000.0 if item.get('wait_until_visible') else None)
 
         self.tree.tag_configure('running', background=RUNNING_COLOR)
         self.tree.tag_configure('fail', background=FAIL_COLOR)
@@ -742,6 +926,8 @@ class App(tk.Tk):
         self.run_after_id = self.after(100, lambda: run_items(start_idx))
 
     def on_close(self):
+        self.run_generation += 1
+        self.match_pool.shutdown(wait=False)
         # 清理热键监听器
         if hasattr(self, '_hotkey_listener') and self._hotkey_listener:
             try:
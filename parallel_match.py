@@ -0,0 +1,162 @@
+"""Match many templates against one frame on a pool of worker processes.
+
+The frame is copied once into a :mod:`multiprocessing.shared_memory` block
+that every worker maps.  Templates given as paths are sent as paths; in-memory
+templates are sent as their registry digest, and their pixels only to a worker
+that reports it has not seen that digest yet.  Each worker keeps the templates
+it was sent acquired in its own registry (up to ``WORKER_TEMPLATES``), so their
+ORB features and pyramids are computed once per worker.  Each worker runs the
+regular :class:`KeyleFinderModule` pipeline, so the results are identical to
+:meth:`KeyleFinderModule.locate_many`.  Spawned workers do not see module
+settings changed at runtime (e.g. by the CLI), so the parent's matching
+defaults are sent along with every task.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import KeyleFinderModule as finder_module
+from KeyleFinderModule import FrameIndex, KeyleFinderModule, TemplateEntry, template_digest, to_bgr
+
+# per-template settings accepted in ``options``
+TEMPLATE_OPTIONS = ('color_mode', 'downsample', 'orb_profile')
+# in-memory templates each worker keeps acquired, least recently used dropped first
+WORKER_TEMPLATES = 256
+
+_templates = {}  # worker side: digest -> acquired TemplateEntry, oldest first
+
+
+def _worker_template(digest, payloads):
+    """Return the worker's entry for ``digest``, acquiring it from ``payloads`` on first sight."""
+    registry = finder_module.template_registry
+    entry = _templates.pop(digest, None)
+    if entry is None:
+        if digest not in payloads:
+            return None
+        entry = registry.acquire(payloads[digest])
+        if entry is None:
+            return None
+        while len(_templates) >= WORKER_TEMPLATES:
+            registry.release(_templates.pop(next(iter(_templates))))
+    _templates[digest] = entry
+    return entry
+
+
+def _locate_chunk(shm_name, shape, origin, config, chunk, payloads=None):
+    """Locate a chunk of jobs; return ``(results, indices of unknown digests)``."""
+    payloads = payloads or {}
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        frame = FrameIndex(image, origin)
+        results, missing = [], []
+        for index, template, roi, options in chunk:
+            if isinstance(template, tuple):
+                digest = template[1]
+                template = _worker_template(digest, payloads)
+                if template is None:
+                    if digest not in payloads:
+                        missing.append(index)
+                        continue
+                    # not decodable; let locate report it like any other bad template
+                    template = payloads[digest]
+            settings = dict(config, **{k: v for k, v in options.items() if v is not None})
+            results.append((index, KeyleFinderModule(frame, **settings).locate(template, roi=roi)))
+        # drop every view of the shared buffer before closing it
+        del frame, image
+        return results, missing
+    finally:
+        shm.close()
+
+
+class ParallelMatcher:
+    """Fan one frame out to ``workers`` processes and locate templates in parallel."""
+
+    def __init__(self, workers=None, pyramid_levels=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pyramid_levels = pyramid_levels
+        # spawn avoids forking a process whose OpenCV thread pool is running
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _config(self):
+        """Return the matching defaults of this process, read at call time."""
+        return {
+            'pyramid_levels': self.pyramid_levels,
+            'scales': finder_module.TEMPLATE_SCALES,
+            'color_mode': finder_module.TEMPLATE_COLOR_MODE,
+            'downsample': finder_module.TEMPLATE_DOWNSAMPLE,
+            'matcher': finder_module.FEATURE_MATCHER,
+            'orb_profile': finder_module.ORB_PROFILE,
+        }
+
+    def locate_many(self, frame, templates, rois=None, options=None):
+        """Return one :meth:`KeyleFinderModule.locate` result per template.
+
+        ``frame`` is anything :class:`KeyleFinderModule` accepts; templates are
+        paths, BGR arrays, encoded image bytes or :class:`TemplateEntry`
+        objects.  ``options`` optionally gives one dict per template with the
+        ``TEMPLATE_OPTIONS`` of its workflow item.
+        """
+        if not templates:
+            return []
+        origin = frame.origin if isinstance(frame, FrameIndex) else (0, 0)
+        image = frame.image if isinstance(frame, FrameIndex) else to_bgr(frame)
+        rois = [None] * len(templates) if rois is None else rois
+        options = [{}] * len(templates) if options is None else options
+        options = [{k: (o or {}).get(k) for k in TEMPLATE_OPTIONS} for o in options]
+        payloads = {}
+        refs = []
+        for t in templates:
+            if isinstance(t, str):
+                refs.append(t)
+                continue
+            if isinstance(t, TemplateEntry):
+                digest, t = t.digest or template_digest(t.image), t.image
+            else:
+                digest = template_digest(t)
+            payloads[digest] = bytes(t) if isinstance(t, memoryview) else t
+            refs.append(('digest', digest))
+        jobs = list(zip(range(len(templates)), refs, rois, options))
+        shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        try:
+            shared = np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf)
+            shared[:] = image
+            del shared
+            config = self._config()
+            results = [None] * len(templates)
+            missing = self._run(jobs, results, shm.name, image.shape, origin, config)
+            if missing:
+                # second round for the workers that had not seen these templates yet
+                jobs = [jobs[i] for i in missing]
+                needed = {digest for _, (_, digest), _, _ in jobs}
+                self._run(jobs, results, shm.name, image.shape, origin, config,
+                          {d: payloads[d] for d in needed})
+            return results
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _run(self, jobs, results, shm_name, shape, origin, config, payloads=None):
+        """Spread ``jobs`` over the workers, fill ``results`` and return the indices they could not run."""
+        chunks = [jobs[i::self.workers] for i in range(self.workers) if jobs[i::self.workers]]
+        futures = [self._pool.submit(_locate_chunk, shm_name, shape, origin, config, chunk, payloads)
+                   for chunk in chunks]
+        missing = []
+        for future in futures:
+            done, unknown = future.result()
+            for index, result in done:
+                results[index] = result
+            missing += unknown
+        return missing
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,68 @@
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import types
+clicks = []
+mock_pg = types.SimpleNamespace(moveTo=lambda *a, **k: clicks.append(('move',) + a), click=lambda *a, **k: clicks.append(('click',)), mouseDown=lambda *a, **k: None, mouseUp=lambda *a, **k: None, position=lambda: (0,0), screenshot=lambda: None, FAILSAFE=True)
+sys.modules["pyautogui"] = mock_pg
+import autoclick_api
+autoclick_api.pyautogui = mock_pg
+import async_workflow
+async_workflow.pyautogui = mock_pg
+from async_workflow import run_concurrent
+from frame_source import ReplaySource
+
+
+def test_groups_share_capture_and_serialise_clicks(monkeypatch):
+    monkeypatch.setattr(async_workflow, 'move_mouse', lambda x, y: clicks.append(('move', x, y)))
+    clicks.clear()
+    source = ReplaySource('demo/layer.png')
+    grabs = []
+    original = source.monitor_frames
+    monkeypatch.setattr(source, 'monitor_frames', lambda monitor=None: grabs.append(1) or original(monitor))
+    main = {'name': 'main', 'items': [{'path': 'demo/middle.png'}, {'path': 'demo/small.png'}]}
+    watcher = {'name': 'watch', 'items': [{'path': 'demo/middle.png', 'delay': 10}], 'loop': True, 'interval': 0.01}
+    run_concurrent([main, watcher], capture=source, workers=2, max_frame_age=10)
+    assert clicks.count(('click',)) >= 2
+    # every move is directly followed by its click
+    for i, entry in enumerate(clicks):
+        if entry[0] == 'move':
+            assert clicks[i + 1] == ('click',)
+    assert len(grabs) < len([c for c in clicks if c[0] == 'move']) + 2
+
+
+def test_action_serializer_keeps_each_move_with_its_click(monkeypatch):
+    import asyncio
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from async_workflow import ActionSerializer
+    log = []
+    # slow, blocking actions like the real pyautogui; the awaits between them let other groups run
+    monkeypatch.setattr(async_workflow, 'move_mouse', lambda x, y: log.append(('move', x)) or time.sleep(0.01))
+    monkeypatch.setattr(async_workflow, 'pyautogui', types.SimpleNamespace(
+        click=lambda **k: log.append(('click',)) or time.sleep(0.01), position=lambda: (0, 0),
+        mouseDown=lambda: None, mouseUp=lambda: None))
+
+    async def main():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            actions = ActionSerializer(types.SimpleNamespace(invalidate=lambda: None), executor)
+            await asyncio.gather(*(actions.click(str(i), i, 0, 'single') for i in range(3)))
+
+    asyncio.run(main())
+    assert log == [('move', 0), ('click',), ('move', 1), ('click',), ('move', 2), ('click',)]
+
+
+def test_match_all_group_clicks_every_instance(tmp_path, monkeypatch):
+    import cv2
+    import numpy as np
+    monkeypatch.setattr(async_workflow, 'move_mouse', lambda x, y: clicks.append(('move', x, y)))
+    clicks.clear()
+    screen = np.full((300, 600, 3), 200, np.uint8)
+    small = cv2.imread('demo/small.png')
+    h, w = small.shape[:2]
+    for x, y in ((20, 10), (400, 150)):
+        screen[y:y + h, x:x + w] = small
+    cv2.imwrite(str(tmp_path / 'screen.png'), screen)
+    item = {'path': 'demo/small.png', 'match_all': True, 'wait_until_visible': True, 'timeout': 1000}
+    run_concurrent([[item]], capture=ReplaySource(str(tmp_path / 'screen.png')))
+    assert [c for c in clicks if c[0] == 'move'] == [('move', 20 + w // 2, 10 + h // 2),
+                                                     ('move', 400 + w // 2, 150 + h // 2)]
+    assert clicks.count(('click',)) == 2
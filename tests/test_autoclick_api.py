@@ -29,7 +29,197 @@ def test_load_and_cleanup_items():
     assert item['delay'] == 100
     assert item['interrupt'] is True
     assert item['enable'] is True
-    assert os.path.exists(item['path'])
+    assert item['path'] is None
+    assert item['template'].shape == (112, 147, 3)
     cleanup_items(items)
-    assert not os.path.exists(item['path'])
+    assert 'template' not in item
     os.unlink(config_path)
+
+
+def test_locate_item_region_grab_reuses_last_hit():
+    from autoclick_api import locate_item
+    from frame_source import ReplaySource
+    source = ReplaySource('demo/layer.png')
+    item = {'path': 'demo/middle.png'}
+    first = locate_item(source, item)
+    assert first['status'] == 0
+    assert item['last_rect'] == first['top_left'] + first['bottom_right']
+    second = locate_item(source, item, region_grab=True)
+    assert second['status'] == 0
+    assert abs(second['top_left'][0] - first['top_left'][0]) <= 3
+
+
+def test_wait_for_item_polls_until_visible(tmp_path):
+    import shutil
+    import numpy as np
+    import cv2
+    from autoclick_api import wait_for_item
+    from frame_source import ReplaySource
+    cv2.imwrite(str(tmp_path / 'a.png'), np.zeros((666, 667, 3), np.uint8))
+    shutil.copy('demo/layer.png', str(tmp_path / 'b.png'))
+    item = {'path': 'demo/middle.png', 'wait_until_visible': True, 'timeout': 2000}
+    result = wait_for_item(ReplaySource(str(tmp_path), loop=False), item)
+    assert result['status'] == 0
+    item['timeout'] = 0
+    assert wait_for_item(ReplaySource(str(tmp_path / 'a.png')), item)['status'] == 1
+
+
+def test_locate_item_on_second_monitor_returns_global_coordinates(tmp_path):
+    import cv2
+    import numpy as np
+    from autoclick_api import locate_item
+    from frame_source import ReplaySource
+    desk = np.zeros((666, 1334, 3), np.uint8)
+    desk[:, 667:] = cv2.imread('demo/layer.png')
+    cv2.imwrite(str(tmp_path / 'desk.png'), desk)
+    single = locate_item(ReplaySource('demo/layer.png'), {'path': 'demo/middle.png'})
+    source = ReplaySource(str(tmp_path / 'desk.png'), monitors=[(0, 0, 667, 666), (667, 0, 1334, 666)])
+    item = {'path': 'demo/middle.png'}
+    result = locate_item(source, item)
+    assert result['status'] == 0
+    assert result['top_left'][0] == single['top_left'][0] + 667
+    assert item['last_rect'][0] >= 667
+    assert locate_item(source, {'path': 'demo/middle.png', 'monitor': 1})['status'] != 0
+
+
+def test_run_workflow_match_all_clicks_every_instance(tmp_path, monkeypatch):
+    import cv2
+    import numpy as np
+    import autoclick_api
+    from frame_source import ReplaySource
+    screen = np.full((300, 600, 3), 200, np.uint8)
+    small = cv2.imread('demo/small.png')
+    h, w = small.shape[:2]
+    for x, y in ((20, 10), (400, 150)):
+        screen[y:y + h, x:x + w] = small
+    cv2.imwrite(str(tmp_path / 'screen.png'), screen)
+    moves = []
+    monkeypatch.setattr(autoclick_api, 'move_mouse', lambda x, y: moves.append((x, y)))
+    monkeypatch.setattr(autoclick_api, 'pyautogui', mock_pg)
+    item = {'path': 'demo/small.png', 'match_all': True}
+    autoclick_api.run_workflow([item], capture=ReplaySource(str(tmp_path / 'screen.png')), cleanup=False)
+    assert moves == [(20 + w // 2, 10 + h // 2), (400 + w // 2, 150 + h // 2)]
+
+
+def test_run_workflow_returns_match_stats(tmp_path, monkeypatch):
+    import autoclick_api
+    from frame_source import ReplaySource
+    monkeypatch.setattr(autoclick_api, 'move_mouse', lambda x, y: None)
+    monkeypatch.setattr(autoclick_api, 'pyautogui', mock_pg)
+    items = [{'path': 'demo/middle.png', 'alias': 'middle'}, {'path': 'demo/small.png', 'alias': 'small'}]
+    stats = autoclick_api.run_workflow(items, capture=ReplaySource('demo/layer.png'), cleanup=False)
+    summary = stats.summary()
+    assert summary['middle']['hits'] == 1 and summary['middle']['engines'] == {'feature': 1}
+    assert 0 < summary['middle']['min_score'] <= 1 and summary['middle']['total_ms'] > 0
+    assert summary['small']['hits'] + summary['small']['misses'] == 1
+    assert 'middle' in stats.format_summary()
+
+
+def test_match_stats_keeps_unlabelled_items_apart():
+    from autoclick_api import MatchStats
+    stats = MatchStats()
+    first, second, ok, twin = {'path': None}, {'path': None}, {'alias': 'ok'}, {'alias': 'ok'}
+    stats.record(first, {'status': 0, 'engine': 'template', 'score': 0.9})
+    stats.record(second, {'status': 1})
+    stats.record(ok, {'status': 0, 'engine': 'feature', 'score': 0.5})
+    stats.record(twin, {'status': 1})
+    summary = stats.summary()
+    assert summary['item 1']['hits'] == 1 and summary['item 2']['misses'] == 1
+    assert summary['ok']['hits'] == 1 and summary['ok #4']['misses'] == 1
+
+
+def test_item_template_is_resolved_once_and_released():
+    import cv2
+    from autoclick_api import item_template
+    from KeyleFinderModule import TemplateEntry, template_registry
+    item = {'path': None, 'template': cv2.imread('demo/small.png')}
+    before = len(template_registry)
+    entry = item_template(item)
+    assert isinstance(entry, TemplateEntry) and item_template(item) is entry
+    assert len(template_registry) == before + 1
+    cleanup_items([item])
+    assert len(template_registry) == before
+
+
+def test_run_workflow_counts_wait_time_toward_delay(monkeypatch):
+    import autoclick_api
+    from frame_source import ReplaySource
+    clock = [0.0]
+    sleeps = []
+
+    def wait_for_item(source, item, **kwargs):
+        clock[0] += 0.2
+        return {'status': 0, 'top_left': [0, 0], 'bottom_right': [10, 10], 'scale': 1.0}
+    monkeypatch.setattr(autoclick_api, 'time', types.SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(autoclick_api, 'wait_for_item', wait_for_item)
+    monkeypatch.setattr(autoclick_api, '_sleep', lambda seconds, stop=None: sleeps.append(seconds))
+    monkeypatch.setattr(autoclick_api, 'move_mouse', lambda x, y: None)
+    monkeypatch.setattr(autoclick_api, 'pyautogui', mock_pg)
+    items = [{'path': 'demo/small.png', 'wait_until_visible': True, 'delay': 500},
+             {'path': 'demo/small.png', 'wait_until_visible': True, 'delay': 100}]
+    autoclick_api.run_workflow(items, capture=ReplaySource('demo/layer.png'), cleanup=False)
+    assert [round(s, 3) for s in sleeps] == [0.3, 0.0]
+
+
+def test_prepare_items_hints_scale_from_recorded_dpi(tmp_path):
+    import cv2
+    import numpy as np
+    from autoclick_api import locate_item, prepare_items
+    from frame_source import ReplaySource
+    screen = np.full((500, 600, 3), 40, np.uint8)
+    big = cv2.resize(cv2.imread('demo/small.png'), None, fx=1.5, fy=1.5)
+    screen[100:100 + big.shape[0], 200:200 + big.shape[1]] = big
+    cv2.imwrite(str(tmp_path / 'screen.png'), screen)
+    source = ReplaySource(str(tmp_path / 'screen.png'))
+    item = {'path': 'demo/small.png', 'dpi_scale': 1.0}
+    prepare_items([item], source)
+    assert item['dpi_ratio'] == 1.0
+    source.dpi_scale = lambda: 1.5
+    prepare_items([item], source)
+    assert item['dpi_ratio'] == 1.5
+    result = locate_item(source, item)
+    assert result['status'] == 0 and abs(result['scale'] - 1.5) < 0.05
+    assert abs(result['top_left'][0] - 200) <= 3 and abs(result['top_left'][1] - 100) <= 3
+
+
+def test_run_workflow_match_all_wait_clicks_instances_of_the_hit_frame(tmp_path, monkeypatch):
+    import cv2
+    import numpy as np
+    import autoclick_api
+    from frame_source import ReplaySource
+    screen = np.full((300, 600, 3), 200, np.uint8)
+    cv2.imwrite(str(tmp_path / 'a.png'), screen)
+    small = cv2.imread('demo/small.png')
+    h, w = small.shape[:2]
+    for x, y in ((20, 10), (400, 150)):
+        screen[y:y + h, x:x + w] = small
+    cv2.imwrite(str(tmp_path / 'b.png'), screen)
+    source = ReplaySource(str(tmp_path), loop=False)
+    grabs = []
+    original = source.monitor_frames
+    monkeypatch.setattr(source, 'monitor_frames', lambda monitor=None: grabs.append(1) or original(monitor))
+    moves = []
+    monkeypatch.setattr(autoclick_api, 'move_mouse', lambda x, y: moves.append((x, y)))
+    monkeypatch.setattr(autoclick_api, 'pyautogui', mock_pg)
+    item = {'path': 'demo/small.png', 'match_all': True, 'wait_until_visible': True, 'timeout': 2000}
+    autoclick_api.run_workflow([item], capture=source, cleanup=False)
+    assert moves == [(20 + w // 2, 10 + h // 2), (400 + w // 2, 150 + h // 2)]
+    assert len(grabs) == 2
+
+
+def test_run_workflow_cleans_up_when_preparing_fails(monkeypatch):
+    import cv2
+    import pytest
+    import autoclick_api
+    from frame_source import ReplaySource
+    source = ReplaySource('demo/layer.png')
+    cached = len(autoclick_api.template_registry)
+    stopped = []
+    original = autoclick_api.CaptureThread.stop
+    monkeypatch.setattr(autoclick_api.CaptureThread, 'stop', lambda self: stopped.append(1) or original(self))
+    good = {'path': None, 'template': cv2.imread('demo/middle.png')}
+    bad = {'path': 'demo/small.png', 'color_mode': 'purple'}
+    with pytest.raises(ValueError):
+        autoclick_api.run_workflow([good, bad], capture=source, background_capture=True)
+    # the background thread is stopped and the acquired template released
+    assert stopped and 'template' not in good and len(autoclick_api.template_registry) == cached
@@ -0,0 +1,93 @@
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import types
+mock_pg = types.SimpleNamespace(moveTo=lambda *a, **k: None, click=lambda *a, **k: None, mouseDown=lambda *a, **k: None, mouseUp=lambda *a, **k: None, position=lambda: (0,0), screenshot=lambda: None, FAILSAFE=True)
+sys.modules["pyautogui"] = mock_pg
+import threading
+from autoclick_daemon import AutoClickDaemon, request
+
+
+def test_daemon_locate_and_status(tmp_path):
+    socket_path = str(tmp_path / 'autoclick.sock')
+    daemon = AutoClickDaemon(socket_path, capture='replay:demo/layer.png')
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        threading.Event().wait(0.01)
+    result = request({'cmd': 'locate', 'template': os.path.abspath('demo/middle.png')}, socket_path, timeout=5)
+    assert result['status'] == 0
+    status = request({'cmd': 'status'}, socket_path, timeout=5)
+    assert status['requests'] == 2
+    assert status['templates'] >= 1
+    assert request({'cmd': 'bogus'}, socket_path, timeout=5)['status'] == -1
+    request({'cmd': 'shutdown'}, socket_path, timeout=5)
+    thread.join(5)
+    assert not os.path.exists(socket_path)
+
+
+def _start(socket_path):
+    daemon = AutoClickDaemon(socket_path, capture='replay:demo/layer.png')
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        threading.Event().wait(0.01)
+    return daemon, thread
+
+
+def test_daemon_looping_workflow_can_be_cancelled_and_shut_down(tmp_path):
+    import json
+    import pytest
+    socket_path = str(tmp_path / 'autoclick.sock')
+    config = tmp_path / 'flow.json'
+    config.write_text(json.dumps([{'path': os.path.abspath('demo/middle.png'), 'alias': 'middle'}]))
+    daemon, thread = _start(socket_path)
+    other = AutoClickDaemon(socket_path, capture='replay:demo/layer.png')
+    with pytest.raises(RuntimeError):
+        other.serve_forever()
+    other.source.close()
+    payload = {'cmd': 'run_workflow', 'config': str(config), 'loop': True, 'interval': 0.01}
+    responses = []
+    runner = threading.Thread(target=lambda: responses.append(request(payload, socket_path, timeout=10)))
+    runner.start()
+    for _ in range(100):
+        if request({'cmd': 'status'}, socket_path, timeout=5)['running']:
+            break
+        threading.Event().wait(0.01)
+    assert request(payload, socket_path, timeout=5)['error'].startswith('busy')
+    assert request({'cmd': 'cancel'}, socket_path, timeout=5)['cancelled'] is True
+    runner.join(5)
+    assert responses[0]['status'] == 0 and responses[0]['cancelled'] is True
+    assert responses[0]['stats']['middle']['hits'] >= 1
+
+    runner = threading.Thread(target=lambda: responses.append(request(payload, socket_path, timeout=10)))
+    runner.start()
+    for _ in range(100):
+        if request({'cmd': 'status'}, socket_path, timeout=5)['running']:
+            break
+        threading.Event().wait(0.01)
+    request({'cmd': 'shutdown'}, socket_path, timeout=5)
+    thread.join(5)
+    runner.join(5)
+    assert not thread.is_alive() and daemon._run is None
+    assert responses[1]['cancelled'] is True
+
+
+def test_daemon_concurrent_locates_agree_and_are_counted(tmp_path):
+    socket_path = str(tmp_path / 'autoclick.sock')
+    daemon, thread = _start(socket_path)
+    payload = {'cmd': 'locate', 'template': os.path.abspath('demo/small.png')}
+    results = []
+    clients = [threading.Thread(target=lambda: results.append(request(payload, socket_path, timeout=10)))
+               for _ in range(8)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    assert len(results) == 8 and all(r['status'] == 0 for r in results)
+    assert len({tuple(r['top_left'] + r['bottom_right']) for r in results}) == 1
+    assert request({'cmd': 'status'}, socket_path, timeout=5)['requests'] == 9
+    request({'cmd': 'shutdown'}, socket_path, timeout=5)
+    thread.join(5)
@@ -0,0 +1,16 @@
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'benchmarks'))
+from bench_finder import format_crossover, format_table, run_benchmark, run_crossover
+
+
+def test_benchmark_smoke():
+    rows = run_benchmark([(480, 320)], ['pyramid', 'locate'], ['identity'], trials=1)
+    assert [r['engine'] for r in rows] == ['pyramid', 'locate']
+    assert all(r['accuracy'] == 1.0 and r['samples'] == 1 for r in rows)
+    assert 'pyramid' in format_table(rows)
+
+
+def test_crossover_smoke():
+    rows = run_crossover((480, 320), feature_counts=(200,), template_counts=(1, 3), trials=1)
+    assert [r['templates'] for r in rows] == [1, 3]
+    assert all(r['bf_ms'] > 0 and r['flann_ms'] > 0 and r['winner'] in ('bf', 'flann') for r in rows)
+    assert 'winner' in format_crossover(rows)
@@ -0,0 +1,112 @@
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import types
+mock_pg = types.SimpleNamespace(moveTo=lambda *a, **k: None, click=lambda *a, **k: None, mouseDown=lambda *a, **k: None, mouseUp=lambda *a, **k: None, position=lambda: (0,0), screenshot=lambda: None, FAILSAFE=True)
+sys.modules["pyautogui"] = mock_pg
+import cv2
+import numpy as np
+from change_detect import TileHasher
+
+
+def test_single_pixel_change_marks_its_tile():
+    hasher = TileHasher(tile=64)
+    gray = cv2.imread('demo/layer.png', cv2.IMREAD_GRAYSCALE)
+    before = hasher.signature(gray)
+    assert before.shape == (11, 11)
+    assert hasher.dirty_rect(before, hasher.signature(gray.copy())) is None
+    changed = gray.copy()
+    changed[200, 130] ^= 1
+    assert hasher.dirty_rect(before, hasher.signature(changed), origin=(5, 0)) == (133, 192, 197, 256)
+
+
+def test_skip_unchanged_reuses_previous_result(tmp_path, monkeypatch):
+    import autoclick_api
+    from frame_source import ReplaySource
+    calls = []
+    original = autoclick_api.KeyleFinderModule.locate
+
+    def counting_locate(self, *args, **kwargs):
+        calls.append(self.big_image.shape)
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(autoclick_api.KeyleFinderModule, 'locate', counting_locate)
+    source = ReplaySource('demo/layer.png')
+    item = {'path': 'demo/middle.png'}
+    first = autoclick_api.locate_item(source, item, skip_unchanged=True)
+    second = autoclick_api.locate_item(source, item, skip_unchanged=True)
+    assert first['status'] == 0 and second['engine'] == 'cached' and second['timings'] == {}
+    assert dict(second, engine=first['engine'], timings=first['timings']) == first
+    assert len(calls) == 1
+
+    blank = np.zeros((666, 667, 3), np.uint8)
+    cv2.imwrite(str(tmp_path / 'a.png'), blank)
+    blank[600:620, 600:620] = 255
+    cv2.imwrite(str(tmp_path / 'b.png'), blank)
+    source = ReplaySource(str(tmp_path), loop=False)
+    item = {'path': 'demo/small.png'}
+    assert autoclick_api.locate_item(source, item, skip_unchanged=True)['status'] == 1
+    calls.clear()
+    assert autoclick_api.locate_item(source, item, skip_unchanged=True)['status'] == 1
+    assert calls and calls[0][0] < 666
+
+
+def test_skip_unchanged_rechecks_cached_hit_on_other_monitor(tmp_path):
+    import autoclick_api
+    from frame_source import ReplaySource
+    layer = cv2.imread('demo/layer.png')
+    desk = np.zeros((666, 1334, 3), np.uint8)
+    desk[:, :667] = layer
+    os.mkdir(str(tmp_path / 'frames'))
+    cv2.imwrite(str(tmp_path / 'frames' / 'a.png'), desk)
+    desk[:, :667] = 0
+    cv2.imwrite(str(tmp_path / 'frames' / 'b.png'), desk)
+    source = ReplaySource(str(tmp_path / 'frames'), loop=False, monitors=[(0, 0, 667, 666), (667, 0, 1334, 666)])
+    item = {'path': 'demo/middle.png'}
+    first = autoclick_api.locate_item(source, item, skip_unchanged=True)
+    assert first['status'] == 0 and first['top_left'][0] < 667
+    # the item was last seen on the second monitor; the cached hit on the first one is gone
+    item['last_rect'] = [900, 100, 1000, 200]
+    assert autoclick_api.locate_item(source, item, skip_unchanged=True)['status'] == 1
+
+
+def test_skip_unchanged_looks_at_changed_tiles_only(tmp_path, monkeypatch):
+    import autoclick_api
+    from frame_source import ReplaySource
+    layer = cv2.imread('demo/layer.png')
+    hasher = TileHasher(tile=64)
+    gray = cv2.cvtColor(layer, cv2.COLOR_BGR2GRAY)
+    corners = gray.copy()
+    corners[5, 5] ^= 1
+    corners[660, 660] ^= 1
+    before, after = hasher.signature(gray), hasher.signature(corners)
+    assert hasher.dirty_rects(before, after) == [(0, 0, 64, 64), (640, 640, 704, 704)]
+    assert hasher.changed_in(before, after, (600, 600, 650, 650))
+    assert not hasher.changed_in(before, after, (100, 100, 300, 300))
+
+    os.mkdir(str(tmp_path / 'hit'))
+    cv2.imwrite(str(tmp_path / 'hit' / 'a.png'), layer)
+    changed = layer.copy()
+    changed[5, 5] ^= 1
+    changed[660, 660] ^= 1
+    cv2.imwrite(str(tmp_path / 'hit' / 'b.png'), changed)
+    source = ReplaySource(str(tmp_path / 'hit'), loop=False)
+    item = {'path': 'demo/middle.png'}
+    assert autoclick_api.locate_item(source, item, skip_unchanged=True)['status'] == 0
+    assert autoclick_api.locate_item(source, item, skip_unchanged=True)['engine'] == 'cached'
+
+    # a miss is re-checked in one small window per changed corner
+    calls = []
+    original = autoclick_api.KeyleFinderModule.locate
+    monkeypatch.setattr(autoclick_api.KeyleFinderModule, 'locate',
+                        lambda self, *a, **k: calls.append(self.big_image.shape) or original(self, *a, **k))
+    os.mkdir(str(tmp_path / 'miss'))
+    blank = np.zeros((666, 667, 3), np.uint8)
+    cv2.imwrite(str(tmp_path / 'miss' / 'a.png'), blank)
+    blank[5:15, 5:15] = 255
+    blank[650:660, 650:660] = 255
+    cv2.imwrite(str(tmp_path / 'miss' / 'b.png'), blank)
+    source = ReplaySource(str(tmp_path / 'miss'), loop=False)
+    item = {'path': 'demo/small.png'}
+    assert autoclick_api.locate_item(source, item, skip_unchanged=True)['status'] == 1
+    calls.clear()
+    assert autoclick_api.locate_item(source, item, skip_unchanged=True)['status'] == 1
+    assert len(calls) == 2 and all(h < 333 and w < 333 for h, w, _ in calls)
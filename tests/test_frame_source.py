@@ -0,0 +1,108 @@
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+from frame_source import ReplaySource, create_frame_source
+
+
+def test_replay_region_frame_keeps_screen_origin():
+    source = create_frame_source('replay:demo/layer.png')
+    assert isinstance(source, ReplaySource)
+    assert source.bounds() == (0, 0, 667, 666)
+    frame = source.frame((10, 300, 400, 700))
+    assert frame.origin == (10, 300)
+    assert frame.image.shape == (366, 390, 3)
+
+
+def test_replay_directory_advances(tmp_path):
+    import shutil
+    shutil.copy('demo/layer.png', str(tmp_path / 'a.png'))
+    shutil.copy('demo/small.png', str(tmp_path / 'b.png'))
+    source = ReplaySource(str(tmp_path), loop=False)
+    assert source.grab().shape == (666, 667, 3)
+    assert source.grab().shape == (112, 147, 3)
+    assert source.grab().shape == (112, 147, 3)
+
+
+def test_capture_thread_serves_newest_frame_from_ring():
+    from frame_source import CaptureThread
+    source = CaptureThread(ReplaySource('demo/layer.png'), slots=3)
+    try:
+        first = source.grab()
+        assert first.shape == (666, 667, 3)
+        source.invalidate()
+        assert source.frame((0, 0, 100, 50)).image.shape == (50, 100, 3)
+        assert len(source._slots) == 3
+    finally:
+        source.close()
+    assert not source._thread.is_alive()
+
+
+def test_monitor_frames_split_and_pin(tmp_path):
+    import cv2
+    import numpy as np
+    import pytest
+    desk = np.zeros((666, 1334, 3), np.uint8)
+    desk[:, 667:] = cv2.imread('demo/layer.png')
+    cv2.imwrite(str(tmp_path / 'desk.png'), desk)
+    source = ReplaySource(str(tmp_path / 'desk.png'), monitors=[(0, 0, 667, 666), (667, 0, 1334, 666)])
+    frames = source.monitor_frames()
+    assert [f.origin for f in frames] == [(0, 0), (667, 0)]
+    assert frames[1].image.shape == (666, 667, 3)
+    assert [f.origin for f in source.monitor_frames(2)] == [(667, 0)]
+    with pytest.raises(ValueError):
+        source.monitor_frames(3)
+
+
+def test_pyautogui_source_uses_screenshot_pixels_on_hidpi(monkeypatch):
+    import types
+    from PIL import Image
+    from frame_source import PyAutoGUISource
+    shot = Image.open('demo/layer.png').convert('RGB')
+    regions = []
+
+    def screenshot(region=None):
+        regions.append(region)
+        return shot if region is None else shot.crop((region[0], region[1], region[0] + region[2],
+                                                       region[1] + region[3]))
+    fake = types.SimpleNamespace(screenshot=screenshot, size=lambda: (333, 333))
+    monkeypatch.setitem(sys.modules, 'pyautogui', fake)
+    source = PyAutoGUISource()
+    assert source.bounds() == (0, 0, 667, 666)
+    frame = source.frame((400, 500, 700, 700))
+    assert frame.origin == (400, 500) and frame.image.shape == (166, 267, 3)
+    assert regions == [None, None]
+    fake.size = lambda: (667, 666)
+    source.grab()
+    assert source.grab((0, 0, 10, 10)).shape == (10, 10, 3) and regions[-1] == (0, 0, 10, 10)
+
+
+def test_capture_thread_retries_failed_grabs_and_closes_source_in_its_thread():
+    import threading
+    import numpy as np
+    from frame_source import CaptureThread, FrameSource
+
+    class Flaky(FrameSource):
+        name = 'flaky'
+
+        def __init__(self):
+            self.failures = 2
+            self.closed_in = []
+
+        def bounds(self):
+            return 0, 0, 8, 4
+
+        def grab(self, region=None):
+            if self.failures:
+                self.failures -= 1
+                raise OSError('display busy')
+            return np.zeros((4, 8, 3), np.uint8)
+
+        def close_thread(self):
+            self.closed_in.append(threading.current_thread().name)
+
+    flaky = Flaky()
+    source = CaptureThread(flaky)
+    try:
+        assert source.grab(timeout=2).shape == (4, 8, 3)
+        assert source.interval > 0
+    finally:
+        source.stop()
+    assert flaky.closed_in == ['autoclick-capture']
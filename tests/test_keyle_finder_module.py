@@ -1,5 +1,9 @@
 import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
-from KeyleFinderModule import KeyleFinderModule
+from KeyleFinderModule import DPI_SCALES, KeyleFinderModule
+
+
+def _untimed(result):
+    return {key: value for key, value in result.items() if key != 'timings'}
 
 
 def test_locate_demo_images():
@@ -12,3 +16,238 @@ def test_locate_demo_images():
     height = br[1] - tl[1]
     assert 300 <= width <= 330
     assert 320 <= height <= 340
+
+
+def test_locate_in_memory_frame():
+    import cv2
+    from PIL import Image
+    expected = _untimed(KeyleFinderModule('demo/layer.png').locate('demo/middle.png'))
+    frame = cv2.imread('demo/layer.png')
+    assert _untimed(KeyleFinderModule(frame).locate('demo/middle.png')) == expected
+    pil_frame = Image.open('demo/layer.png').convert('RGB')
+    assert _untimed(KeyleFinderModule(pil_frame).locate('demo/middle.png')) == expected
+
+
+def test_template_registry_reuses_and_invalidates(tmp_path):
+    import shutil
+    from KeyleFinderModule import TemplateRegistry
+    registry = TemplateRegistry()
+    path = str(tmp_path / 'tpl.png')
+    shutil.copy('demo/middle.png', path)
+    first = registry.get(path)
+    assert first is registry.get(path)
+    assert registry.get('demo/middle.png') is first
+    shutil.copy('demo/small.png', path)
+    os.utime(path, ns=(0, 0))
+    second = registry.get(path)
+    assert second is not first
+    assert second.image.shape == (112, 147, 3)
+
+
+def test_locate_many_shares_frame_index():
+    from KeyleFinderModule import FrameIndex
+    frame = FrameIndex('demo/layer.png')
+    finder = KeyleFinderModule(frame)
+    results = finder.locate_many(['demo/middle.png', 'demo/middle.png'])
+    assert _untimed(results[0]) == _untimed(results[1]) == _untimed(finder.locate('demo/middle.png'))
+    assert results[0]["status"] == 0
+    assert frame.pyramid(2).shape == (167, 167)
+
+
+def test_locate_with_roi_matches_full_search():
+    finder = KeyleFinderModule('demo/layer.png')
+    full = finder.locate('demo/middle.png')
+    roi = full["top_left"] + full["bottom_right"]
+    near = finder.locate('demo/middle.png', roi=roi)
+    assert near["status"] == 0
+    for a, b in zip(near["top_left"] + near["bottom_right"], roi):
+        assert abs(a - b) <= 3
+    far = finder.locate('demo/middle.png', roi=[0, 0, 10, 10])
+    assert far["status"] == 0
+
+
+def test_pyramid_template_match_equals_full_resolution():
+    for template in ('demo/middle.png', 'demo/small.png'):
+        coarse = KeyleFinderModule('demo/layer.png', pyramid_levels=2)._match_template(template)
+        full = KeyleFinderModule('demo/layer.png', pyramid_levels=0)._match_template(template)
+        assert coarse[1][:4] == full[1][:4]
+        assert abs(coarse[0] - full[0]) < 1e-4
+
+
+def test_template_match_finds_other_dpi_and_reports_scale():
+    import cv2
+    import numpy as np
+    screen = np.full((500, 600, 3), 40, np.uint8)
+    template = cv2.imread('demo/small.png')
+    big = cv2.resize(template, None, fx=1.5, fy=1.5)
+    screen[100:100 + big.shape[0], 200:200 + big.shape[1]] = big
+    assert KeyleFinderModule(screen)._match_template(template) is None
+    finder = KeyleFinderModule(screen, scales=DPI_SCALES)
+    assert finder._match_template(template, scale=1.0, all_scales=False) is None
+    score, match, scale = finder._match_template(template)
+    assert scale == 1.5 and match[0] == (200, 100)
+    assert finder._scale_order(1.5)[0] == 1.5
+    default = KeyleFinderModule(screen)
+    assert default._scale_order(None) == [1.0] and default._scale_order(1.5) == [1.5, 1.0]
+    assert default._match_template(template, scale=1.5)[2] == 1.5
+    assert abs(finder.locate(template, scale=1.5)['scale'] - 1.5) < 0.05
+
+
+def test_registry_keeps_entry_when_file_is_touched(tmp_path):
+    from KeyleFinderModule import TemplateRegistry
+    path = tmp_path / 't.png'
+    path.write_bytes(open('demo/small.png', 'rb').read())
+    registry = TemplateRegistry()
+    first = registry.get(str(path))
+    os.utime(path, ns=(0, 0))
+    assert registry.get(str(path)) is first
+    assert registry.get(str(path)) is first
+
+
+def test_color_modes_and_downsample_find_same_spot():
+    import pytest
+    full = KeyleFinderModule('demo/layer.png')._match_template('demo/middle.png')[1]
+    for mode in ('gray', 'g'):
+        for down in (1, 2, 4):
+            hit = KeyleFinderModule('demo/layer.png', color_mode=mode, downsample=down)._match_template('demo/middle.png')
+            assert hit is not None
+            assert abs(hit[1][0][0] - full[0][0]) <= down and abs(hit[1][0][1] - full[0][1]) <= down
+            assert hit[1][1][0] - hit[1][0][0] == full[1][0] - full[0][0]
+    with pytest.raises(ValueError):
+        KeyleFinderModule('demo/layer.png', color_mode='hsv')
+
+
+def test_flann_matcher_agrees_with_brute_force():
+    import cv2
+    from KeyleFinderModule import FrameIndex
+    frame = FrameIndex(cv2.imread('demo/layer.png'))
+    bf = KeyleFinderModule(frame, matcher='bf').locate('demo/middle.png')
+    flann = KeyleFinderModule(frame, matcher='flann').locate('demo/middle.png')
+    assert flann['status'] == 0
+    assert all(abs(a - b) <= 3 for a, b in zip(bf['top_left'] + bf['bottom_right'],
+                                               flann['top_left'] + flann['bottom_right']))
+    assert 'default' in frame._matchers
+
+
+def test_orb_profiles_and_grid_bucketing():
+    import cv2
+    import numpy as np
+    import pytest
+    from KeyleFinderModule import _bucket_keypoints
+    # a dense cluster in one corner and a few weak points elsewhere
+    kps = [cv2.KeyPoint(float(x % 50), float(x // 50), 7, response=1.0) for x in range(500)]
+    kps += [cv2.KeyPoint(150.0 + x, 150.0, 7, response=0.1) for x in range(4)]
+    kept = _bucket_keypoints(kps, (200, 200), (2, 2), 8)
+    assert len(kept) == 8
+    assert sum(kp.pt[0] > 100 for kp in kept) == 4
+    frame = KeyleFinderModule('demo/layer.png', orb_profile='accurate').frame
+    assert len(frame.detect('accurate')[0]) > len(frame.detect('default')[0])
+    assert KeyleFinderModule(frame, orb_profile='balanced').locate('demo/middle.png')['status'] == 0
+    with pytest.raises(ValueError):
+        KeyleFinderModule(frame, orb_profile='turbo')
+
+
+def test_knn_arrays_match_bfmatcher_and_pad_missing_neighbours():
+    import cv2
+    import numpy as np
+    from KeyleFinderModule import TemplateEntry, knn_bruteforce
+    query = TemplateEntry(cv2.imread('demo/middle.png')).descriptors
+    train = TemplateEntry(cv2.imread('demo/layer.png')).descriptors
+    distances, indices = knn_bruteforce(query, train)
+    expected = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(query, train, k=2)
+    assert np.array_equal(distances, [[m.distance for m in pair] for pair in expected])
+    assert np.array_equal(distances[:, 0], [pair[0].distance for pair in expected])
+    distances, indices = knn_bruteforce(query, train[:1])
+    assert indices.shape == (len(query), 2) and (indices[:, 1] == -1).all()
+    tiny = np.zeros((40, 40, 3), np.uint8)
+    tiny[10:20, 10:20] = 255
+    assert KeyleFinderModule(tiny)._match_feature('demo/middle.png') is None
+
+
+def test_locate_all_finds_every_instance(monkeypatch):
+    import cv2
+    import numpy as np
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'benchmarks'))
+    from bench_finder import synthetic_desktop
+    screen = synthetic_desktop(1600, 900, np.random.default_rng(0))
+    template = cv2.imread('demo/middle.png')
+    h, w = template.shape[:2]
+    spots = [(30, 40), (500, 60), (1100, 300), (200, 520)]
+    for x, y in spots:
+        screen[y:y + h, x:x + w] = template
+    finder = KeyleFinderModule(screen, orb_profile='balanced')
+    results = finder.locate_all(template)
+    assert sorted(tuple(r['top_left']) for r in results) == sorted(spots)
+    assert all(r['score'] >= 0.8 for r in results)
+    instances = finder._feature_instances(finder.registry.get(template), finder.frame, 10)
+    assert len(instances) == 4
+    flat = np.full((300, 600, 3), 200, np.uint8)
+    small = cv2.imread('demo/small.png')
+    flat[10:10 + small.shape[0], 20:20 + small.shape[1]] = small
+    flat[150:150 + small.shape[0], 400:400 + small.shape[1]] = small
+    results = KeyleFinderModule(flat).locate_all(small, max_results=1)
+    assert len(results) == 1
+    # the debug preview draws exactly the returned hits
+    drawn = []
+    monkeypatch.setattr(cv2, 'polylines', lambda image, pts, *a, **k: drawn.append(pts[0]))
+    for name in ('imshow', 'waitKey', 'destroyAllWindows'):
+        monkeypatch.setattr(cv2, name, lambda *a, **k: None)
+    results = KeyleFinderModule(flat).locate_all(small, max_results=1, debug=True)
+    assert len(drawn) == 1 and tuple(drawn[0].min(axis=0).reshape(-1)) == tuple(results[0]['top_left'])
+
+
+def test_locate_reports_match_metadata():
+    import cv2
+    result = KeyleFinderModule('demo/layer.png').locate('demo/middle.png')
+    assert result["engine"] == "feature"
+    assert 0 < result["inlier_ratio"] <= 1 and result["score"] == result["inlier_ratio"]
+    assert result["inliers"] >= 3 and isinstance(result["angle"], float)
+    assert {"feature", "total"} <= set(result["timings"])
+    frame = cv2.imread('demo/layer.png')
+    tile = frame[40:90, 60:140].copy()
+    hit = KeyleFinderModule(frame, scales=(1.0,)).locate(tile)
+    assert hit["status"] == 0 and hit["engine"] == "template" and "inliers" not in hit
+    assert hit["score"] >= 0.8 and "template" in hit["timings"]
+    miss = KeyleFinderModule(frame[:60, :60].copy()).locate('demo/middle.png')
+    assert miss["status"] == 1 and "total" in miss["timings"]
+
+
+def test_registry_evicts_released_in_memory_templates():
+    import cv2
+    from KeyleFinderModule import TemplateRegistry
+    registry = TemplateRegistry()
+    image = cv2.imread('demo/small.png')
+    assert registry.get(image) is not registry.get(image) and len(registry) == 0
+    first = registry.acquire(image)
+    assert registry.acquire(image.copy()) is first and registry.get(image) is first
+    registry.release(first)
+    assert len(registry) == 1
+    registry.release(first)
+    assert len(registry) == 0
+
+
+def test_shared_frame_and_template_caches_are_thread_safe():
+    import threading
+    import cv2
+    from KeyleFinderModule import FrameIndex, TemplateEntry
+    image = cv2.imread('demo/layer.png')
+    for _ in range(20):
+        frame = FrameIndex(image)
+        entry = TemplateEntry(image[100:260, 100:300].copy(), features=False)
+        barrier = threading.Barrier(8)
+
+        def build():
+            barrier.wait()
+            frame.pyramid(3)
+            entry.pyramid(3)
+            entry.scaled(1.5).pyramid(2)
+
+        threads = [threading.Thread(target=build) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(frame._pyramid) == 4 and len(entry._pyramid) == 4
+        for pyramid in (frame._pyramid, entry._pyramid):
+            for upper, lower in zip(pyramid, pyramid[1:]):
+                assert lower.shape == ((upper.shape[0] + 1) // 2, (upper.shape[1] + 1) // 2)
@@ -0,0 +1,48 @@
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+from KeyleFinderModule import KeyleFinderModule
+from parallel_match import ParallelMatcher
+
+
+def _untimed(result):
+    return {key: value for key, value in result.items() if key != 'timings'}
+
+
+def test_parallel_results_match_serial():
+    templates = ['demo/middle.png', 'demo/small.png', 'demo/layer.png', 'demo/middle.png']
+    serial = [_untimed(r) for r in KeyleFinderModule('demo/layer.png').locate_many(templates)]
+    with ParallelMatcher(workers=2) as matcher:
+        assert [_untimed(r) for r in matcher.locate_many('demo/layer.png', templates)] == serial
+
+
+def test_parallel_matcher_forwards_runtime_settings(monkeypatch):
+    import cv2
+    import KeyleFinderModule as finder_module
+    frame = cv2.imread('demo/layer.png')
+    tile = frame[300:400, 300:420].copy()
+    templates = [cv2.resize(tile, None, fx=1.5, fy=1.5), tile, tile]
+    options = [None, None, {'color_mode': 'gray', 'downsample': 2, 'orb_profile': 'fast'}]
+    monkeypatch.setattr(finder_module, 'TEMPLATE_SCALES', finder_module.DPI_SCALES)
+    monkeypatch.setattr(finder_module, 'FEATURE_MATCHER', 'flann')
+    serial = [_untimed(KeyleFinderModule(frame, **(o or {})).locate(t)) for t, o in zip(templates, options)]
+    assert serial[0]["status"] == 0 and serial[0]["scale"] == 0.667 and serial[1]["engine"] == serial[2]["engine"] == "template"
+    assert serial[1]["score"] != serial[2]["score"]
+    with ParallelMatcher(workers=2) as matcher:
+        parallel = matcher.locate_many(frame, templates, options=options)
+    assert [_untimed(r) for r in parallel] == serial
+
+
+def test_parallel_matcher_sends_in_memory_templates_once_per_worker():
+    import cv2
+    frame = cv2.imread('demo/layer.png')
+    with open('demo/small.png', 'rb') as f:
+        encoded = f.read()
+    templates = [cv2.imread('demo/middle.png'), encoded]
+    serial = [_untimed(r) for r in KeyleFinderModule(frame).locate_many(templates)]
+    with ParallelMatcher(workers=1) as matcher:
+        payloads = []
+        submit = matcher._pool.submit
+        matcher._pool.submit = lambda fn, *args: payloads.append(args[-1]) or submit(fn, *args)
+        for _ in range(2):
+            assert [_untimed(r) for r in matcher.locate_many(frame, templates)] == serial
+    # only the first call had to send the pixels, after the worker asked for them
+    assert payloads[0] is None and len(payloads[1]) == 2 and payloads[2:] == [None]
@@ -0,0 +1,28 @@
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import json
+from KeyleFinderModule import KeyleFinderModule
+from tracing import Tracer, tracer
+
+
+def test_disabled_tracer_records_nothing():
+    t = Tracer()
+    with t.span('phase'):
+        pass
+    assert not t.events
+
+
+def test_locate_spans_export_chrome_trace(tmp_path):
+    tracer.enabled = True
+    tracer.clear()
+    try:
+        KeyleFinderModule('demo/layer.png').locate('demo/middle.png')
+    finally:
+        tracer.enabled = False
+    summary = tracer.summary()
+    assert {'orb.detect', 'orb.knn_match', 'locate.feature'} <= set(summary)
+    path = str(tmp_path / 'trace.json')
+    tracer.export_chrome(path)
+    with open(path, encoding='utf-8') as f:
+        events = json.load(f)['traceEvents']
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+    assert 'orb.detect' in tracer.format_summary()
@@ -0,0 +1,89 @@
+import os, sys; sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import types
+mock_pg = types.SimpleNamespace(moveTo=lambda *a, **k: None, click=lambda *a, **k: None, mouseDown=lambda *a, **k: None, mouseUp=lambda *a, **k: None, position=lambda: (0,0), screenshot=lambda: None, FAILSAFE=True)
+sys.modules["pyautogui"] = mock_pg
+import base64
+import json
+from KeyleFinderModule import KeyleFinderModule
+from workflow_pack import WorkflowPack, is_pack, json_to_pack, pack_to_json
+
+
+def _write_json(path):
+    with open('demo/middle.png', 'rb') as f:
+        encoded = base64.b64encode(f.read()).decode('utf-8')
+    data = [{'image': encoded, 'alias': '按钮', 'action': 'double', 'delay': 50},
+            {'image': encoded, 'action': 'single', 'enable': False}]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    return data
+
+
+def test_pack_round_trip(tmp_path):
+    src = str(tmp_path / 'flow.json')
+    data = _write_json(src)
+    for raw in (False, True):
+        pack_path = str(tmp_path / 'flow.acwf')
+        json_to_pack(src, pack_path, raw=raw)
+        assert is_pack(pack_path) and not is_pack(src)
+        pack = WorkflowPack(pack_path)
+        assert len(pack) == 2
+        assert pack.entries[0]['alias'] == '按钮'
+        out = str(tmp_path / 'back.json')
+        pack_to_json(pack_path, out)
+        with open(out, encoding='utf-8') as f:
+            back = json.load(f)
+        assert [{k: v for k, v in e.items() if k != 'image'} for e in back] == \
+               [{k: v for k, v in e.items() if k != 'image'} for e in data]
+        if not raw:
+            assert back == data
+            assert os.path.getsize(pack_path) < os.path.getsize(src)
+
+
+def test_load_items_from_pack_matches_in_memory(tmp_path):
+    from autoclick_api import item_template, load_items
+    src = str(tmp_path / 'flow.json')
+    _write_json(src)
+    pack_path = str(tmp_path / 'flow.acwf')
+    json_to_pack(src, pack_path)
+    items = load_items(pack_path)
+    assert items[0]['action'] == 'double' and items[1]['enable'] is False
+    assert items[0]['path'] is None
+    result = KeyleFinderModule('demo/layer.png').locate(item_template(items[0]))
+    expected = KeyleFinderModule('demo/layer.png').locate('demo/middle.png')
+    result.pop('timings'), expected.pop('timings')
+    assert result == expected
+
+
+def test_pack_from_paths_is_closed_by_cleanup(tmp_path):
+    from autoclick_api import cleanup_items, item_template, load_items
+    from workflow_pack import write_pack
+    pack_path = str(tmp_path / 'flow.acwf')
+    write_pack(pack_path, [{'path': 'demo/middle.png', 'alias': 'a'}, {'path': 'demo/small.png'}], raw=True)
+    with WorkflowPack(pack_path) as pack:
+        assert pack.entries[0] == {'path': 'demo/middle.png', 'alias': 'a'}
+        assert pack.template(1).shape == (112, 147, 3)
+    assert pack._mm is None
+    items = load_items(pack_path)
+    pack = items[0]['pack']
+    assert KeyleFinderModule('demo/layer.png').locate(item_template(items[0]))['status'] == 0
+    cleanup_items(items)
+    assert pack._mm is None and 'pack' not in items[0]
+
+
+def test_pack_close_releases_views_still_held_by_callers(tmp_path):
+    import pytest
+    from autoclick_api import cleanup_items, load_items
+    from workflow_pack import write_pack
+    pack_path = str(tmp_path / 'flow.acwf')
+    write_pack(pack_path, [{'path': 'demo/middle.png'}, {'path': 'demo/small.png'}])
+    pack = WorkflowPack(pack_path)
+    held = pack.template(0)
+    pack.close()
+    assert pack._mm is None
+    with pytest.raises(ValueError):
+        bytes(held)
+    # unresolved items hand their views back without relying on the caller's locals
+    items = load_items(pack_path)
+    pack = items[-1]['pack']
+    cleanup_items(items)
+    assert pack._mm is None
@@ -0,0 +1,106 @@
+"""Lightweight span tracing for the capture/match/click hot path.
+
+Instrumented code wraps each phase in ``with tracer.span('name'):``.  While
+the global :data:`tracer` is disabled (the default) a span is a shared no-op
+object, so the cost is one attribute check.  When enabled, the most recent
+spans are kept in a bounded buffer and can be exported as a Chrome trace
+(open it in ``chrome://tracing`` or https://ui.perfetto.dev) or summarised
+per phase.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer.events.append((self.name, self.start, end - self.start, threading.get_ident(), self.args))
+        return False
+
+
+class Tracer:
+    """Record named spans; keeps only the last ``max_events`` of them."""
+
+    def __init__(self, enabled=False, max_events=100000):
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def clear(self):
+        self.events.clear()
+
+    def summary(self):
+        """Return ``{phase: {count, total_ms, mean_ms, p50_ms, p95_ms, max_ms}}`` over the buffered spans."""
+        phases = {}
+        for name, _, dur, _, _ in list(self.events):
+            phases.setdefault(name, []).append(dur / 1e6)
+        stats = {}
+        for name, durs in phases.items():
+            durs.sort()
+            n = len(durs)
+            stats[name] = {
+                'count': n,
+                'total_ms': sum(durs),
+                'mean_ms': sum(durs) / n,
+                'p50_ms': durs[(n - 1) // 2],
+                'p95_ms': durs[min(n - 1, int(n * 0.95))],
+                'max_ms': durs[-1],
+            }
+        return stats
+
+    def format_summary(self):
+        """Return :meth:`summary` as a text table sorted by total time."""
+        stats = self.summary()
+        header = f"{'phase':<24}{'count':>7}{'total ms':>11}{'mean ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}"
+        lines = [header, '-' * len(header)]
+        for name, s in sorted(stats.items(), key=lambda kv: -kv[1]['total_ms']):
+            lines.append(f"{name:<24}{s['count']:>7}{s['total_ms']:>11.1f}{s['mean_ms']:>10.2f}"
+                         f"{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['max_ms']:>9.2f}")
+        return '\n'.join(lines)
+
+    def export_chrome(self, path):
+        """Write the buffered spans as a Chrome/Perfetto trace JSON file."""
+        pid = os.getpid()
+        events = [{
+            'name': name,
+            'ph': 'X',
+            'ts': start / 1000.0,
+            'dur': dur / 1000.0,
+            'pid': pid,
+            'tid': tid,
+            'args': args,
+        } for name, start, dur, tid, args in list(self.events)]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+tracer = Tracer()
@@ -0,0 +1,182 @@
+"""Compact binary container for workflows (``.acwf``).
+
+JSON exports store every template as base64 inside one array, which inflates
+them by a third and forces a full parse before anything runs.  A pack stores
+the same items as::
+
+    header    magic b'ACWF', version, item count, metadata length
+    index     one record per item: blob offset, blob length, blob kind, width, height
+    metadata  UTF-8 JSON array of the item settings (the JSON export without 'image')
+    blobs     raw PNG files, or pre-decoded BGR pixels with ``raw=True``
+
+:class:`WorkflowPack` maps the file with :mod:`mmap` and only reads the
+header, index and metadata up front; blobs are sliced out of the mapping
+when a template is first matched.  Convert from and to the JSON export with::
+
+    python workflow_pack.py pack workflow.json workflow.acwf [--raw]
+    python workflow_pack.py unpack workflow.acwf workflow.json
+"""
+import argparse
+import base64
+import json
+import mmap
+import struct
+
+import cv2
+import numpy as np
+
+MAGIC = b'ACWF'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')  # magic, version, reserved, count, metadata length
+INDEX = struct.Struct('<QQB3xII')  # offset, length, kind, width, height
+
+KIND_PNG = 0
+KIND_RAW = 1  # height x width x 3 BGR uint8
+
+
+def is_pack(path):
+    """Return True when ``path`` starts with the pack magic."""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_pack(path, entries, raw=False):
+    """Write JSON-export style ``entries`` (base64 ``image`` plus settings) to ``path``.
+
+    Entries without ``image`` are read from their ``path``.  With ``raw``
+    the templates are stored as decoded BGR pixels, which are larger on
+    disk but need no PNG decoding when loaded.
+    """
+    blobs, meta, index = [], [], []
+    for entry in entries:
+        if 'image' in entry:
+            data = base64.b64decode(entry['image'])
+        else:
+            with open(entry['path'], 'rb') as f:
+                data = f.read()
+        if raw:
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError(f"Cannot decode image of item {len(blobs)}")
+            blobs.append(np.ascontiguousarray(image).tobytes())
+            index.append((KIND_RAW, image.shape[1], image.shape[0]))
+        else:
+            blobs.append(data)
+            index.append((KIND_PNG, 0, 0))
+        meta.append({k: v for k, v in entry.items() if k != 'image'})
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    offset = HEADER.size + INDEX.size * len(blobs) + len(meta_bytes)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(blobs), len(meta_bytes)))
+        for blob, (kind, width, height) in zip(blobs, index):
+            f.write(INDEX.pack(offset, len(blob), kind, width, height))
+            offset += len(blob)
+        f.write(meta_bytes)
+        for blob in blobs:
+            f.write(blob)
+
+
+class WorkflowPack:
+    """Read-only, memory-mapped view of a pack written by :func:`write_pack`.
+
+    Call :meth:`close` (or use it as a context manager) once the templates
+    are no longer needed; an open mapping keeps the file locked on Windows.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []  # memoryviews handed out by template(), released by close()
+        magic, version, _, count, meta_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an AutoClick workflow pack')
+        if version > VERSION:
+            raise ValueError(f'{path} uses pack version {version}, this build reads up to {VERSION}')
+        self._index = [INDEX.unpack_from(self._mm, HEADER.size + i * INDEX.size) for i in range(count)]
+        meta_start = HEADER.size + count * INDEX.size
+        self.entries = json.loads(bytes(self._mm[meta_start:meta_start + meta_len]).decode('utf-8'))
+
+    def __len__(self):
+        return len(self._index)
+
+    def template(self, i):
+        """Return item ``i``'s template without copying it out of the mapping.
+
+        PNG blobs come back as a ``memoryview`` of the encoded data, raw blobs
+        as a read-only BGR ``ndarray`` view.  :meth:`close` releases these
+        views; a raw array still referenced at that point keeps it from
+        closing.
+        """
+        offset, length, kind, width, height = self._index[i]
+        view = memoryview(self._mm)[offset:offset + length]
+        self._views.append(view)
+        if kind == KIND_RAW:
+            return np.frombuffer(view, np.uint8).reshape(height, width, 3)
+        return view
+
+    def png_bytes(self, i):
+        """Return item ``i`` as encoded PNG ``bytes``."""
+        offset, length, kind, _, _ = self._index[i]
+        if kind == KIND_RAW:
+            image = self.template(i)
+            ok, buf = cv2.imencode('.png', image)
+            del image
+            self._views.pop().release()
+            if not ok:
+                raise ValueError(f'Cannot encode image of item {i}')
+            return buf.tobytes()
+        return self._mm[offset:offset + length]
+
+    def to_entries(self):
+        """Return the items in the JSON export format."""
+        return [dict(entry, image=base64.b64encode(self.png_bytes(i)).decode('utf-8'))
+                for i, entry in enumerate(self.entries)]
+
+    def close(self):
+        """Release the views handed out by :meth:`template` and unmap the file."""
+        if self._mm is not None:
+            for view in self._views:
+                view.release()
+            self._views = []
+            self._mm.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def json_to_pack(json_path, pack_path, raw=False):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        write_pack(pack_path, json.load(f), raw=raw)
+
+
+def pack_to_json(pack_path, json_path):
+    with WorkflowPack(pack_path) as pack:
+        entries = pack.to_entries()
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert AutoClick workflows between JSON and the binary pack format')
+    sub = parser.add_subparsers(dest='command', required=True)
+    pack = sub.add_parser('pack', help='convert a JSON export to a pack')
+    pack.add_argument('source')
+    pack.add_argument('target')
+    pack.add_argument('--raw', action='store_true', help='store decoded pixels instead of PNG data')
+    unpack = sub.add_parser('unpack', help='convert a pack back to a JSON export')
+    unpack.add_argument('source')
+    unpack.add_argument('target')
+    args = parser.parse_args()
+    if args.command == 'pack':
+        json_to_pack(args.source, args.target, raw=args.raw)
+    else:
+        pack_to_json(args.source, args.target)
+
+
+if __name__ == '__main__':
+    main()